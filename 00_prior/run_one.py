@@ -21,6 +21,7 @@ from typing import Dict
 import plot_prior
 from rncrp.data.synthetic import sample_dcrp
 from rncrp.helpers.dynamics import convert_dynamics_str_to_dynamics_obj
+from rncrp.helpers.numpy_helpers import convert_cluster_assignments_to_one_hot
 from rncrp.helpers.run import set_seed
 
 
@@ -57,7 +58,9 @@ def run_one(args: argparse.Namespace):
     dynamics_latex_str = 'Time Function: ' + dynamics_latex_str
 
     plot_prior.plot_customer_assignments_analytical_vs_monte_carlo(
-        sampled_customer_assignments_by_customer=monte_carlo_rncrp_results['one_hot_customer_assignments_by_customer'],
+        sampled_customer_assignments_by_customer=convert_cluster_assignments_to_one_hot(
+            cluster_assignments=monte_carlo_rncrp_results['customer_assignments_by_customer'],
+            num_clusters=args.num_customer),
         analytical_customer_assignments_by_customer=analytical_dcrp_results['customer_assignment_probs_by_customer'],
         alpha=args.alpha,
         beta=args.beta,
@@ -65,7 +68,9 @@ def run_one(args: argparse.Namespace):
         dynamics_latex_str=dynamics_latex_str)
 
     plot_prior.plot_num_tables_analytical_vs_monte_carlo(
-        sampled_num_tables_by_customer=monte_carlo_rncrp_results['num_tables_by_customer'],
+        sampled_num_tables_by_customer=convert_cluster_assignments_to_one_hot(
+            cluster_assignments=monte_carlo_rncrp_results['num_tables_by_customer'] - 1,
+            num_clusters=args.num_customer),
         analytical_num_tables_by_customer=analytical_dcrp_results['num_table_probs_by_customer'],
         alpha=args.alpha,
         beta=args.beta,
@@ -263,7 +268,8 @@ def sample_monte_carlo_rncrp_and_save(num_customer: int,
             num_customer=num_customer,
             alpha=alpha,
             beta=beta,
-            dynamics_str=dynamics_str)
+            dynamics_str=dynamics_str,
+            record_pseudo_table_occupancies=True)
         logging.info(f'Generated samples for {monte_carlo_rncrp_path}')
         joblib.dump(filename=monte_carlo_rncrp_path,
                     value=monte_carlo_rncrp_results)
@@ -276,10 +282,8 @@ def sample_monte_carlo_rncrp_and_save(num_customer: int,
            == (num_mc_sample, num_customer, num_customer)
     assert monte_carlo_rncrp_results['customer_assignments_by_customer'].shape \
            == (num_mc_sample, num_customer)
-    assert monte_carlo_rncrp_results['one_hot_customer_assignments_by_customer'].shape \
-           == (num_mc_sample, num_customer, num_customer)
     assert monte_carlo_rncrp_results['num_tables_by_customer'].shape \
-           == (num_mc_sample, num_customer, num_customer)
+           == (num_mc_sample, num_customer)
 
     logging.info(f'Loaded samples for {monte_carlo_rncrp_path}')
     return monte_carlo_rncrp_results
@@ -25,7 +25,7 @@ sweep_names_str = ','.join(sweep_names)
 print(f'Analyzing sweeps {sweep_names_str}')
 sweep_results_dir_path = os.path.join(results_dir, sweep_names_str)
 os.makedirs(sweep_results_dir_path, exist_ok=True)
-sweep_results_df_path = os.path.join(sweep_results_dir_path, f'sweeps={sweep_names_str}_results.csv')
+sweep_results_df_path = os.path.join(sweep_results_dir_path, f'sweeps={sweep_names_str}_results.parquet')
 
 
 all_inf_algs_results_df = download_wandb_project_runs_configs(
@@ -27,10 +27,10 @@ if not os.path.isfile(sweep_results_df_path):
     sweep_results_df['snr'] = sweep_results_df['centroids_prior_cov_prefactor'] \
                                               / sweep_results_df['likelihood_cov_prefactor']
 
-    sweep_results_df.to_csv(sweep_results_df_path, index=False)
+    sweep_results_df.to_parquet(sweep_results_df_path, index=False, compression='zstd')
 
 else:
-    sweep_results_df = pd.read_csv(sweep_results_df_path)
+    sweep_results_df = pd.read_parquet(sweep_results_df_path)
 
 print(f"Number of runs: {sweep_results_df.shape[0]} for sweep={sweep_name}")
 
@@ -122,6 +122,9 @@ wandb.log({
 # wandb.log({'training_reconstruction_error': sum_sqrd_distances}, step=0)
 
 
+# The inference object holds all of its internal state; store only its results.
+inference_alg_results.pop('inference_alg', None)
+
 data_to_store = dict(
     config=dict(config),  # Need to convert WandB config to proper dict
     inference_alg_results=inference_alg_results,
@@ -129,6 +132,7 @@ data_to_store = dict(
     )
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 print('Finished run.')
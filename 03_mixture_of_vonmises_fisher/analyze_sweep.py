@@ -18,7 +18,7 @@ sweep_results_dir_path = os.path.join(results_dir, sweep_names_str)
 os.makedirs(sweep_results_dir_path, exist_ok=True)
 sweep_results_df_path = os.path.join(
     sweep_results_dir_path,
-    f'sweep={sweep_names_str}_results.csv')
+    f'sweep={sweep_names_str}_results.parquet')
 
 if not os.path.isfile(sweep_results_df_path):
 
@@ -29,10 +29,10 @@ if not os.path.isfile(sweep_results_df_path):
     # Compute SNR
     sweep_results_df['snr'] = np.sqrt(sweep_results_df['likelihood_kappa'])
 
-    sweep_results_df.to_csv(sweep_results_df_path, index=False)
+    sweep_results_df.to_parquet(sweep_results_df_path, index=False, compression='zstd')
 
 else:
-    sweep_results_df = pd.read_csv(sweep_results_df_path)
+    sweep_results_df = pd.read_parquet(sweep_results_df_path)
 
 print(f"Number of runs: {sweep_results_df.shape[0]} for sweeps={sweep_names_str}")
 
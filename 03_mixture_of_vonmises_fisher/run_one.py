@@ -15,6 +15,7 @@ import wandb
 
 import rncrp.data.synthetic
 import rncrp.helpers.dynamics
+import rncrp.helpers.numpy_helpers
 import rncrp.helpers.run
 import rncrp.metrics
 import rncrp.plot.plot_general
@@ -122,6 +123,9 @@ inference_alg_results['training_reconstruction_error'] = sum_sqrd_distances
 wandb.log({'training_reconstruction_error': sum_sqrd_distances}, step=0)
 
 
+# The inference object holds all of its internal state; store only its results.
+inference_alg_results.pop('inference_alg', None)
+
 data_to_store = dict(
     config=dict(config),  # Need to convert WandB config to proper dict
     inference_alg_results=inference_alg_results,
@@ -129,7 +133,8 @@ data_to_store = dict(
     scores=scores)
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 inf_alg_plot_dir_name = ""
 for key, value in dict(config).items():
@@ -145,7 +150,9 @@ os.makedirs(inf_alg_plot_dir_path, exist_ok=True)
 
 try:
     rncrp.plot.plot_general.plot_cluster_assignments_inferred_vs_true(
-        true_cluster_assignments_one_hot=mixture_model_results['cluster_assignments_one_hot'],
+        true_cluster_assignments_one_hot=rncrp.helpers.numpy_helpers.convert_cluster_assignments_to_one_hot(
+            cluster_assignments=mixture_model_results['cluster_assignments'],
+            num_clusters=config['n_samples']),
         cluster_assignment_posteriors=inference_alg_results['cluster_assignment_posteriors'],
         plot_dir=inf_alg_plot_dir_path,
     )
@@ -12,17 +12,17 @@ wandb_sweep_path = "" ## TODO: FILL IN
 sweep_name = '' ## TODO: FILL IN
 sweep_dir = os.path.join(results_dir, sweep_name)
 os.makedirs(sweep_dir, exist_ok=True)
-sweep_results_df_path = os.path.join(sweep_dir, f'sweep={sweep_name}_results.csv')
+sweep_results_df_path = os.path.join(sweep_dir, f'sweep={sweep_name}_results.parquet')
 
 if not os.path.isfile(sweep_results_df_path):
 
     sweep_results_df = download_wandb_project_runs_results(
         wandb_project_path=wandb_sweep_path,
         sweep_name=sweep_name)
-    sweep_results_df.to_csv(sweep_results_df_path, index=False)
+    sweep_results_df.to_parquet(sweep_results_df_path, index=False, compression='zstd')
 
 else:
-    sweep_results_df = pd.read_csv(sweep_results_df_path, index_col=False)
+    sweep_results_df = pd.read_parquet(sweep_results_df_path)
 
 # Generate data for cluster ratio plots
 # generate_and_save_cluster_ratio_data(all_inf_algs_results_df=sweep_results_df,
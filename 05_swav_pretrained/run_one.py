@@ -35,6 +35,7 @@ config_defaults = {
     'robbins_monro_cavi_updates': True,
     'imagenet_split': 'val',
     'transition_prob': 0.005,
+    'batch_size': 64,
 }
 
 wandb.init(project='dcrp-swav-pretrained',
@@ -61,10 +62,11 @@ swav_imagenet_dataloader = rncrp.data.real_nontabular.load_dataloader_swav_image
     split=config['imagenet_split'],
     n_samples=config['n_samples'],
     n_starting_classes=config['n_starting_classes'],
-    transition_prob=config['transition_prob'])
+    transition_prob=config['transition_prob'],
+    batch_size=config['batch_size'])
 
 # Construct observation times
-num_obs = len(swav_imagenet_dataloader)
+num_obs = len(swav_imagenet_dataloader.dataset)
 assert num_obs == config['n_samples']
 observation_times = np.arange(num_obs)
 
@@ -123,6 +125,9 @@ wandb.log({
     step=0)
 
 
+# The inference object holds all of its internal state; store only its results.
+inference_alg_results.pop('inference_alg', None)
+
 data_to_store = dict(
     config=dict(config),  # Need to convert WandB config to proper dict
     inference_alg_results=inference_alg_results,
@@ -130,6 +135,7 @@ data_to_store = dict(
     scores=scores)
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 print('Finished run.')
@@ -14,17 +14,17 @@ wandb_sweep_path = "rylan/dcrp-omniglot"
 sweep_name = 'opi7cxik'
 sweep_dir = os.path.join(results_dir, sweep_name)
 os.makedirs(sweep_dir, exist_ok=True)
-sweep_results_df_path = os.path.join(sweep_dir, f'sweep={sweep_name}_results.csv')
+sweep_results_df_path = os.path.join(sweep_dir, f'sweep={sweep_name}_results.parquet')
 
 if not os.path.isfile(sweep_results_df_path):
     sweep_results_df = download_wandb_project_runs_results(
         wandb_project_path=wandb_sweep_path,
         sweep_id=sweep_name)
 
-    sweep_results_df.to_csv(sweep_results_df_path, index=False)
+    sweep_results_df.to_parquet(sweep_results_df_path, index=False, compression='zstd')
 
 else:
-    sweep_results_df = pd.read_csv(sweep_results_df_path)
+    sweep_results_df = pd.read_parquet(sweep_results_df_path)
 
 print(f"Number of runs: {sweep_results_df.shape[0]} for sweep={sweep_name}")
 
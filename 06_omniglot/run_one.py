@@ -107,12 +107,16 @@ inference_alg_results.update(scores)
 inference_alg_results['map_cluster_assignments'] = map_cluster_assignments
 wandb.log(scores, step=0)
 
+# The inference object holds all of its internal state; store only its results.
+inference_alg_results.pop('inference_alg', None)
+
 data_to_store = dict(
     config=dict(config),  # Need to convert WandB config to proper dict
     inference_alg_results=inference_alg_results,
     scores=scores)
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 print('Finished 06_omniglot/run_one.py.')
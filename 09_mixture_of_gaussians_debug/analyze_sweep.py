@@ -13,7 +13,7 @@ wandb_sweep_path = "rylan/dcrp-mixture-of-gaussians-debug"
 sweep_name = '1z40f04i'
 sweep_results_dir_path = os.path.join(results_dir, sweep_name)
 os.makedirs(sweep_results_dir_path, exist_ok=True)
-sweep_results_df_path = os.path.join(sweep_results_dir_path, f'sweep={sweep_name}_results.csv')
+sweep_results_df_path = os.path.join(sweep_results_dir_path, f'sweep={sweep_name}_results.parquet')
 
 if not os.path.isfile(sweep_results_df_path):
 
@@ -26,10 +26,10 @@ if not os.path.isfile(sweep_results_df_path):
         sweep_results_df['centroids_prior_cov_prefactor'] \
         / sweep_results_df['likelihood_cov_prefactor'])
 
-    sweep_results_df.to_csv(sweep_results_df_path, index=False)
+    sweep_results_df.to_parquet(sweep_results_df_path, index=False, compression='zstd')
 
 else:
-    sweep_results_df = pd.read_csv(sweep_results_df_path)
+    sweep_results_df = pd.read_parquet(sweep_results_df_path)
 
 print(f"Number of runs: {sweep_results_df.shape[0]} for sweep={sweep_name}")
 
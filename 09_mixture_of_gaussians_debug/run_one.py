@@ -122,6 +122,9 @@ inference_alg_results['training_reconstruction_error'] = sum_sqrd_distances
 wandb.log({'training_reconstruction_error': sum_sqrd_distances}, step=0)
 
 
+# The inference object holds all of its internal state; store only its results.
+inference_alg_results.pop('inference_alg', None)
+
 data_to_store = dict(
     config=dict(config),  # Need to convert WandB config to proper dict
     inference_alg_results=inference_alg_results,
@@ -129,7 +132,8 @@ data_to_store = dict(
     scores=scores)
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 
 # inf_alg_plot_dir_name = ""
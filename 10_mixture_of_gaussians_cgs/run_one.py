@@ -133,6 +133,7 @@ data_to_store = dict(
     gweke_test_results=gweke_test_results)
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 print(f'Finished 10_mixture_of_gaussians_cgs/run_one.py for run={wandb.run.id}.')
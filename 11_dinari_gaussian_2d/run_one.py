@@ -142,13 +142,17 @@ else:
 inference_alg_results.update(scores)
 wandb.log(scores, step=0)
 
+# The inference object holds all of its internal state; store only its results.
+inference_alg_results.pop('inference_alg', None)
+
 data_to_store = dict(
     config=dict(config),  # Need to convert WandB config to proper dict
     inference_alg_results=inference_alg_results,
     scores=scores)
 
 joblib.dump(data_to_store,
-            filename=inf_alg_results_path)
+            filename=inf_alg_results_path,
+            compress=('lz4', 3))
 
 inf_alg_plot_dir_name = ""
 for key, value in dict(config).items():
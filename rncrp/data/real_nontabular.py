@@ -59,7 +59,7 @@ class SwavImageNet2021Dataset(Dataset):
         return sample
 
     def _create_labels_to_indices_list(self) -> List[np.ndarray]:
-        labels = np.zeros(self.__len__(), dtype=np.int)
+        labels = np.zeros(self.__len__(), dtype=int)
         indices = np.arange(self.__len__())
         for file_idx, file_path in enumerate(self.file_paths):
             labels[file_idx] = self.__getitem__(idx=file_idx)['target']
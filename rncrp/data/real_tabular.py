@@ -506,7 +506,7 @@ def load_dataset_dinari_covertype_2022(data_dir: str = 'data',
     data_path = os.path.join(dataset_dir, 'forest_normalized.csv')
     preprocessed_data = pd.read_csv(data_path, index_col=False, header=None).values
     observations = preprocessed_data[:, :-1]
-    labels = preprocessed_data[:, -1].astype(np.int)
+    labels = preprocessed_data[:, -1].astype(int)
 
     dataset_dict = dict(
         observations=observations,
@@ -522,7 +522,7 @@ def load_dataset_dinari_gaussian_2d_2022(data_dir: str = 'data',
 
     data = pd.read_csv(data_path, index_col=False, header=False).values
     observations = data.values[:, :-1]
-    labels = data[:, -1].astype(np.int)
+    labels = data[:, -1].astype(int)
     dataset_dict = dict(
         observations=observations,
         labels=labels)
@@ -537,7 +537,7 @@ def load_dataset_dinari_imagenet_full_2022(data_dir: str = 'data',
 
     data = pd.read_csv(data_path, index_col=False, header=False).values
     observations = data.values[:, :-1]
-    labels = data[:, -1].astype(np.int)
+    labels = data[:, -1].astype(int)
     dataset_dict = dict(
         observations=observations,
         labels=labels)
@@ -552,7 +552,7 @@ def load_dataset_dinari_imagenet_short_2022(data_dir: str = 'data',
 
     data = pd.read_csv(data_path, index_col=False, header=False).values
     observations = data.values[:, :-1]
-    labels = data[:, -1].astype(np.int)
+    labels = data[:, -1].astype(int)
     dataset_dict = dict(
         observations=observations,
         labels=labels)
@@ -567,7 +567,7 @@ def load_dataset_dinari_multinomial_2022(data_dir: str = 'data',
 
     data = pd.read_csv(data_path, index_col=False, header=False).values
     observations = data.values[:, :-1]
-    labels = data[:, -1].astype(np.int)
+    labels = data[:, -1].astype(int)
     dataset_dict = dict(
         observations=observations,
         labels=labels)
@@ -582,7 +582,7 @@ def load_dataset_dinari_newsgroup_2022(data_dir: str = 'data',
 
     data = pd.read_csv(data_path, index_col=False, header=False).values
     observations = data.values[:, :-1]
-    labels = data[:, -1].astype(np.int)
+    labels = data[:, -1].astype(int)
     dataset_dict = dict(
         observations=observations,
         labels=labels)
@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import pandas as pd
 
 
@@ -25,7 +27,8 @@ def satisfy_dates(
 #################################################################
 # Filter for stations with sufficient data (tmin, tmax, pcpn)
 #################################################################
-def qualify_checker(df):
+def qualify_checker(df: pd.DataFrame,
+                    end_year: int = 2020):
     col_names = df.columns
     if 'TMIN' not in col_names or 'TMAX' not in col_names or 'PRCP' not in col_names:
         return False
@@ -33,43 +36,62 @@ def qualify_checker(df):
     min_required_days = {1: 28, 2: 26, 3: 28, 4: 27, 5: 28, 6: 27, 7: 28, 8: 28, 9: 27, 10: 28, 11: 27, 12: 28}
     max_nulls = {1: 3, 2: 2, 3: 3, 4: 3, 5: 3, 6: 3, 7: 3, 8: 3, 9: 3, 10: 3, 11: 3, 12: 3}
 
-    df['YEAR'] = df.DATE.apply(lambda x: int(x[:4]))
-    df['MONTH'] = df.DATE.apply(lambda x: int(x[5:7]))
-
-    for year in range(1946, end_year + 1):
-        for month in range(1, 13):
-            # At least 90% data present per month (and thus per year)
-            if df[(df.YEAR == year) & (df.MONTH == month)].TMIN.count().sum() < min_required_days[month]:
-                return False
-            if df[(df.YEAR == year) & (df.MONTH == month)].TMAX.count().sum() < min_required_days[month]:
-                return False
-            if df[(df.YEAR == year) & (df.MONTH == month)].PRCP.count().sum() < min_required_days[month]:
-                return False
-            # No more than 10% of data missing per month (and thus per year)
-            if df[(df.YEAR == year) & (df.MONTH == month)].TMIN.isnull().sum() > max_nulls[month]:
-                return False
-            if df[(df.YEAR == year) & (df.MONTH == month)].TMAX.isnull().sum() > max_nulls[month]:
-                return False
-            if df[(df.YEAR == year) & (df.MONTH == month)].PRCP.isnull().sum() > max_nulls[month]:
-                return False
+    # Parse dates once in C rather than slicing strings row by row.
+    dates = pd.to_datetime(df.DATE, format='%Y-%m-%d', cache=True)
+    df = df.assign(YEAR=dates.dt.year.astype('int16'),
+                   MONTH=dates.dt.month.astype('int8'))
+    df = df[df.YEAR.between(1946, end_year)]
+
+    # Non-null and total number of entries per (year, month). Year-months with no
+    # rows at all are added with zero counts so that they fail the check below.
+    agg = df.groupby(['YEAR', 'MONTH'])[['TMIN', 'TMAX', 'PRCP']].agg(['count', 'size'])
+    agg = agg.reindex(
+        pd.MultiIndex.from_product([range(1946, end_year + 1), range(1, 13)],
+                                   names=['YEAR', 'MONTH']),
+        fill_value=0)
+    counts = agg.xs('count', axis=1, level=1)
+    nulls = agg.xs('size', axis=1, level=1) - counts
+    months = counts.index.get_level_values('MONTH')
+
+    # At least 90% data present per month (and thus per year)
+    if counts.lt(months.map(min_required_days).to_numpy(), axis=0).values.any():
+        return False
+    # No more than 10% of data missing per month (and thus per year)
+    if nulls.gt(months.map(max_nulls).to_numpy(), axis=0).values.any():
+        return False
     return True
 
 
-def get_qualifying_sites(end_year: int = 2020):
-    qualifying_sites = []
-    qualifying_site_links = []
+def check_site(site_name: str,
+               end_year: int = 2020):
+    site_csv_path = '/om2/user/gkml/FieteLab-Recursive-Nonstationary-CRP/exp2_climate/data/' + site_name + '.csv'
+    site_csv_link = 'https://www.ncei.noaa.gov/data/global-historical-climatology-network-daily/access/' + site_name + '.csv'
+
+    # Load file into dataframe; only the columns qualify_checker uses are parsed.
+    df = pd.read_csv(site_csv_path,
+                     usecols=lambda col: col in {'DATE', 'TMIN', 'TMAX', 'PRCP'},
+                     dtype={'DATE': str},
+                     low_memory=False)
+    # df = pd.read_csv(site_csv, compression='gzip',low_memory=False) # if .gz version downloaded
+
+    return site_csv_path, site_csv_link, qualify_checker(df, end_year=end_year)
+
+
+def get_qualifying_sites(end_year: int = 2020,
+                         max_workers: int = None):
     with open('/om2/user/gkml/FieteLab-Recursive-Nonstationary-CRP/exp2_climate/sites_with_valid_dates_' + str(
             end_year) + '.txt') as file:
-        for site_name in file:
-            site_csv_path = '/om2/user/gkml/FieteLab-Recursive-Nonstationary-CRP/exp2_climate/data/' + site_name.strip() + '.csv'
-            site_csv_link = 'https://www.ncei.noaa.gov/data/global-historical-climatology-network-daily/access/' + site_name.strip() + '.csv'
-
-            # Load file into dataframe
-            df = pd.read_csv(site_csv_path, low_memory=False)
-            # df = pd.read_csv(site_csv, compression='gzip',low_memory=False) # if .gz version downloaded
+        site_names = [site_name.strip() for site_name in file]
 
+    # Sites are independent, so load and check them in parallel.
+    qualifying_sites = []
+    qualifying_site_links = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for site_name, (site_csv_path, site_csv_link, qualified) in zip(
+                site_names,
+                executor.map(partial(check_site, end_year=end_year), site_names, chunksize=16)):
             # If criteria satisfied
-            if qualify_checker(df):
+            if qualified:
                 qualifying_sites.append(site_csv_path)
                 qualifying_site_links.append(site_csv_link)
                 print(site_name)
@@ -88,6 +110,7 @@ def get_qualifying_sites(end_year: int = 2020):
     f.close()
 
 
-end_year = 2015
-# satisfy_dates(end_year=end_year)
-get_qualifying_sites(end_year)
+if __name__ == '__main__':
+    end_year = 2015
+    # satisfy_dates(end_year=end_year)
+    get_qualifying_sites(end_year)
@@ -1,4 +1,5 @@
 import joblib
+import numba
 import numpy as np
 import os
 import scipy.stats
@@ -29,7 +30,7 @@ def generate_heald_exp1a() -> Dict[str, np.ndarray]:
                             for phase_and_num_trial in phases_and_num_trials])
     observations = np.zeros(shape=(total_num_trials, 2))
     observations_times = 1. + np.arange(total_num_trials)
-    cluster_assignments = np.zeros(total_num_trials, dtype=np.int)
+    cluster_assignments = np.zeros(total_num_trials, dtype=int)
 
     phase_start_trial_idx = 0
     for phase, phase_num_trials in phases_and_num_trials:
@@ -53,7 +54,6 @@ def generate_heald_exp1a() -> Dict[str, np.ndarray]:
 
     heald_exp_1a_dict = dict(
         cluster_assignments=cluster_assignments,
-        cluster_assignments_one_hot=cluster_assignments_one_hot,
         observations=observations,
         observations_times=observations_times,
     )
@@ -80,7 +80,7 @@ def generate_heald_exp1b() -> Dict[str, np.ndarray]:
                             for phase_and_num_trial in phases_and_num_trials])
     observations = np.zeros(shape=(total_num_trials, 2))
     observations_times = 1. + np.arange(total_num_trials)
-    cluster_assignments = np.zeros(total_num_trials, dtype=np.int)
+    cluster_assignments = np.zeros(total_num_trials, dtype=int)
 
     phase_start_trial_idx = 0
     for phase, phase_num_trials in phases_and_num_trials:
@@ -104,7 +104,6 @@ def generate_heald_exp1b() -> Dict[str, np.ndarray]:
 
     heald_exp_1b_dict = dict(
         cluster_assignments=cluster_assignments,
-        cluster_assignments_one_hot=cluster_assignments_one_hot,
         observations=observations,
         observations_times=observations_times,
     )
@@ -187,27 +186,22 @@ def sample_mixture_model(num_obs: int = 100,
 
     # Sample components.
     if component_prior_str == 'gaussian':
-        means = np.random.multivariate_normal(
-            mean=np.zeros(obs_dim),
-            cov=component_prior_params['centroids_prior_cov_prefactor'] * np.eye(obs_dim),
-            size=num_components)
+        # The centroid prior and likelihood covariances are isotropic, so each is
+        # represented by a scalar and sampled with an elementwise scaling.
+        means = np.sqrt(component_prior_params['centroids_prior_cov_prefactor']) \
+                * np.random.standard_normal(size=(num_components, obs_dim))
 
-        # all Gaussians have same covariance
+        # all Gaussians have same covariance, cov_scale * I
         # TODO: generalize this so that arbitrary covariances can be used
-        cov = component_prior_params['likelihood_cov_prefactor'] * np.eye(obs_dim)
-        covs = np.repeat(
-            cov[np.newaxis, :, :],
-            repeats=num_components,
-            axis=0)
+        cov_scale = component_prior_params['likelihood_cov_prefactor']
 
         components = dict(component_prior_str=component_prior_str,
                           means=means,
-                          covs=covs)
+                          cov_scale=cov_scale,
+                          num_components=num_components)
 
-        observations = np.array([
-            np.random.multivariate_normal(mean=means[assigned_cluster],
-                                          cov=covs[assigned_cluster])
-            for assigned_cluster in cluster_assignments])
+        observations = means[cluster_assignments] \
+                       + np.sqrt(cov_scale) * np.random.standard_normal(size=(num_obs, obs_dim))
 
         # import matplotlib.pyplot as plt
         #
@@ -278,16 +272,12 @@ def sample_mixture_model(num_obs: int = 100,
     else:
         raise NotImplementedError
 
-    cluster_assignments_one_hot = np.zeros((num_obs, num_obs))
-    cluster_assignments_one_hot[np.arange(num_obs), cluster_assignments] = 1.
-
     mixture_model_result = dict(
         mixing_prior_str=mixing_prior_str,
         mixing_distribution_params=mixing_distribution_params,
         component_prior_str=component_prior_str,
         component_prior_params=component_prior_params,
         cluster_assignments=cluster_assignments,
-        cluster_assignments_one_hot=cluster_assignments_one_hot,
         observations=observations,
         observations_times=observations_times,
         components=components,
@@ -302,8 +292,14 @@ def sample_dcrp(num_mc_samples: int,
                 alpha: float,
                 beta: float,
                 dynamics_str: str,
-                dynamics_params: Dict[str, float] = None
+                dynamics_params: Dict[str, float] = None,
+                record_pseudo_table_occupancies: bool = False,
                 ) -> Dict[str, Union[np.ndarray, rncrp.helpers.dynamics.Dynamics]]:
+    """
+    Assignments and numbers of tables are integers with shape (num mc samples, num customer).
+    Pseudo-table occupancies are (num mc samples, num customer, num customer), so are
+    only recorded if requested.
+    """
     assert alpha > 0.
     assert beta >= 0.
 
@@ -319,65 +315,144 @@ def sample_dcrp(num_mc_samples: int,
 
     customer_times = time_sampling_fn(num_customers=num_customer)
 
-    pseudo_table_occupancies_by_customer = np.zeros(
-        shape=(num_mc_samples, num_customer, num_customer))
-    one_hot_customer_assignments_by_customer = np.zeros(
-        shape=(num_mc_samples, num_customer, num_customer))
+    # Assignments and table counts are < num_customer, so use the narrowest integer type.
+    int_dtype = np.int16 if num_customer <= np.iinfo(np.int16).max else np.int32
     customer_assignments_by_customer = np.zeros(
         shape=(num_mc_samples, num_customer,),
-        dtype=np.int)
+        dtype=int_dtype)
     num_tables_by_customer = np.zeros(
-        shape=(num_mc_samples, num_customer, num_customer))
+        shape=(num_mc_samples, num_customer,),
+        dtype=int_dtype)
+    if record_pseudo_table_occupancies:
+        pseudo_table_occupancies_by_customer = np.zeros(
+            shape=(num_mc_samples, num_customer, num_customer))
+    else:
+        pseudo_table_occupancies_by_customer = np.zeros(
+            shape=(num_mc_samples, 0, 0))
 
     # the first customer always goes at the first table
-    pseudo_table_occupancies_by_customer[:, 0, 0] = 1
-    one_hot_customer_assignments_by_customer[:, 0, 0] = 1.
-    num_tables_by_customer[:, 0, 0] = 1.
-
-    for mc_sample_idx in range(num_mc_samples):
-        new_table_idx = 1
+    num_tables_by_customer[:, 0] = 1
+    if record_pseudo_table_occupancies:
+        pseudo_table_occupancies_by_customer[:, 0, 0] = 1
+
+    if isinstance(dynamics, rncrp.helpers.dynamics.LinearFirstOrderNumpy):
+        # Step and exponential dynamics have a closed form, so the entire sequential
+        # customer loop can be compiled. Uniforms are drawn here so that NumPy's
+        # seed controls the samples.
+        decay_factors = np.exp(
+            - dynamics.params['b'] * np.diff(customer_times) / dynamics.params['a'])
+        rand_uniforms = np.random.random(size=(num_mc_samples, num_customer))
+        _sample_dcrp_linear_first_order(
+            pseudo_table_occupancies_out=pseudo_table_occupancies_by_customer,
+            customer_assignments_out=customer_assignments_by_customer,
+            num_tables_out=num_tables_by_customer,
+            alpha=alpha,
+            decay_factors=decay_factors,
+            rand_uniforms=rand_uniforms,
+            record_pseudo_table_occupancies=record_pseudo_table_occupancies)
+    else:
+        # Advance all Monte Carlo samples in lockstep; the dynamics act elementwise,
+        # so each state has shape (num mc samples, num customer).
+        mc_sample_indices = np.arange(num_mc_samples)
+        table_indices = np.arange(num_customer)
+        new_table_idx = np.ones(shape=(num_mc_samples,), dtype=int_dtype)
+        rand_uniforms = np.random.random(size=(num_mc_samples, num_customer))
+
+        # Dynamics consume one-hot vectors; reuse one buffer for all customers.
+        customer_assignments_one_hot = np.zeros(shape=(num_mc_samples, num_customer))
+        customer_assignments_one_hot[:, 0] = 1.
         dynamics.initialize_state(
-            customer_assignment_probs=one_hot_customer_assignments_by_customer[mc_sample_idx, 0, :],
+            customer_assignment_probs=customer_assignments_one_hot.copy(),
             time=customer_times[0])
+        customer_assignments_one_hot[:, 0] = 0.
+
         for cstmr_idx in range(1, num_customer):
             state = dynamics.run_dynamics(
                 time_start=customer_times[cstmr_idx - 1],
                 time_end=customer_times[cstmr_idx])
-            current_pseudo_table_occupancies = state['N'].copy()
-            pseudo_table_occupancies_by_customer[mc_sample_idx, cstmr_idx, :] = current_pseudo_table_occupancies
 
-            # Add alpha, normalize and sample from that distribution.
-            current_pseudo_table_occupancies[new_table_idx] = alpha
-            probs = current_pseudo_table_occupancies / np.sum(current_pseudo_table_occupancies)
-            customer_assignment = np.random.choice(np.arange(new_table_idx + 1),
-                                                   p=probs[:new_table_idx + 1])
-            assert customer_assignment < cstmr_idx + 1
-
-            # store sampled customer
-            one_hot_customer_assignments_by_customer[mc_sample_idx, cstmr_idx, customer_assignment] = 1.
-            new_table_idx = max(new_table_idx, customer_assignment + 1)
-            num_tables_by_customer[mc_sample_idx, cstmr_idx, new_table_idx - 1] = 1.
-            customer_assignments_by_customer[mc_sample_idx, cstmr_idx] = customer_assignment
+            # Add alpha at each sample's new table and zero out the tables after it.
+            current_pseudo_table_occupancies = np.where(
+                table_indices[np.newaxis, :cstmr_idx + 1] < new_table_idx[:, np.newaxis],
+                state['N'][:, :cstmr_idx + 1],
+                0.)
+            current_pseudo_table_occupancies[mc_sample_indices, new_table_idx] = alpha
+
+            # Sample from the unnormalized distribution via the inverse CDF.
+            cum_pseudo_table_occupancies = np.cumsum(current_pseudo_table_occupancies, axis=1)
+            # Counting entries <= the scaled uniform is a row-wise searchsorted(side='right').
+            customer_assignments = np.sum(
+                cum_pseudo_table_occupancies
+                <= rand_uniforms[:, cstmr_idx, np.newaxis] * cum_pseudo_table_occupancies[:, -1:],
+                axis=1)
+            # Guard against rounding pushing the scaled uniform onto the total mass.
+            customer_assignments = np.minimum(customer_assignments, new_table_idx)
+
+            # store sampled customers
+            new_table_idx = np.maximum(new_table_idx, customer_assignments + 1)
+            num_tables_by_customer[:, cstmr_idx] = new_table_idx
+            customer_assignments_by_customer[:, cstmr_idx] = customer_assignments
 
             # Increment psuedo-table occupancies
+            customer_assignments_one_hot[mc_sample_indices, customer_assignments] = 1.
             state = dynamics.update_state(
-                customer_assignment_probs=one_hot_customer_assignments_by_customer[mc_sample_idx, cstmr_idx, :],
+                customer_assignment_probs=customer_assignments_one_hot,
                 time=customer_times[cstmr_idx])
-            pseudo_table_occupancies_by_customer[mc_sample_idx, cstmr_idx, :] = state['N'].copy()
+            customer_assignments_one_hot[mc_sample_indices, customer_assignments] = 0.
+            if record_pseudo_table_occupancies:
+                pseudo_table_occupancies_by_customer[:, cstmr_idx, :] = state['N']
 
     monte_carlo_rncrp_results = {
         'dynamics': dynamics,
         'customer_times': customer_times,
-        'pseudo_table_occupancies_by_customer': pseudo_table_occupancies_by_customer,
         'customer_assignments_by_customer': customer_assignments_by_customer,
-        'one_hot_customer_assignments_by_customer': one_hot_customer_assignments_by_customer,
         'num_tables_by_customer': num_tables_by_customer,
     }
-
-    # import matplotlib.pyplot as plt
-    # plt.close()
-    # plt.imshow(one_hot_customer_assignments_by_customer[0, :, :],
-    #            cmap='Spectral_r',)
-    # plt.show()
+    if record_pseudo_table_occupancies:
+        monte_carlo_rncrp_results['pseudo_table_occupancies_by_customer'] = pseudo_table_occupancies_by_customer
 
     return monte_carlo_rncrp_results
+
+
+@numba.njit(cache=True)
+def _sample_dcrp_linear_first_order(pseudo_table_occupancies_out: np.ndarray,
+                                    customer_assignments_out: np.ndarray,
+                                    num_tables_out: np.ndarray,
+                                    alpha: float,
+                                    decay_factors: np.ndarray,
+                                    rand_uniforms: np.ndarray,
+                                    record_pseudo_table_occupancies: bool) -> None:
+    """
+    Compiled equivalent of running LinearFirstOrderNumpy dynamics inside sample_dcrp.
+
+    decay_factors: shape (num customer - 1, ), multiplicative decay between customers
+    rand_uniforms: shape (num mc samples, num customer), Uniform(0, 1) draws
+    """
+    num_mc_samples, num_customer = customer_assignments_out.shape
+    for mc_sample_idx in range(num_mc_samples):
+        pseudo_table_occupancies = np.zeros(num_customer)
+        pseudo_table_occupancies[0] = 1.
+        new_table_idx = 1
+        for cstmr_idx in range(1, num_customer):
+            pseudo_table_occupancies[:new_table_idx] *= decay_factors[cstmr_idx - 1]
+
+            # Add alpha and sample via the inverse CDF. Scaling the uniform by the
+            # total mass avoids normalizing. The new table is unoccupied, so its
+            # entry can temporarily hold alpha.
+            pseudo_table_occupancies[new_table_idx] = alpha
+            cdf = np.cumsum(pseudo_table_occupancies[:new_table_idx + 1])
+            pseudo_table_occupancies[new_table_idx] = 0.
+            customer_assignment = np.searchsorted(
+                cdf, rand_uniforms[mc_sample_idx, cstmr_idx] * cdf[-1], side='right')
+            # Guard against rounding pushing the scaled uniform onto cdf[-1].
+            customer_assignment = min(customer_assignment, new_table_idx)
+
+            # store sampled customer
+            new_table_idx = max(new_table_idx, customer_assignment + 1)
+            num_tables_out[mc_sample_idx, cstmr_idx] = new_table_idx
+            customer_assignments_out[mc_sample_idx, cstmr_idx] = customer_assignment
+
+            # Increment psuedo-table occupancies
+            pseudo_table_occupancies[customer_assignment] += 1.
+            if record_pseudo_table_occupancies:
+                pseudo_table_occupancies_out[mc_sample_idx, cstmr_idx, :] = pseudo_table_occupancies
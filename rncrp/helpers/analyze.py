@@ -1,10 +1,14 @@
+from collections import defaultdict
+import datetime
 import joblib
 import os
 import pandas as pd
 import numpy as np
-from typing import List
+from typing import Dict, List, Union
 import wandb
 
+from rncrp.helpers.numpy_helpers import compute_running_num_unique
+
 
 def download_wandb_project_runs_configs(wandb_project_path: str,
                                         data_dir: str,
@@ -12,28 +16,55 @@ def download_wandb_project_runs_configs(wandb_project_path: str,
                                         finished_only: bool = True,
                                         refresh: bool = False,
                                         ) -> pd.DataFrame:
+    """
+    Download each run's config and summary into a dataframe with one row per run,
+    cached on disk. On refresh, only runs updated since the last download are
+    fetched and merged into the cached rows by run_id.
+    """
     runs_configs_df_path = os.path.join(
         data_dir,
-        'sweeps=' + ','.join(sweep_ids) + '_runs_configs.csv')
-    if refresh or not os.path.isfile(runs_configs_df_path):
+        'sweeps=' + ','.join(sweep_ids) + '_runs_configs'
+        + ('' if finished_only else '_all') + '.parquet')
+    have_cache = os.path.isfile(runs_configs_df_path)
+    if refresh or not have_cache:
+
+        # Filter server-side so that unwanted runs are never transferred.
+        filters = {'state': 'finished'} if finished_only else {}
+
+        cached_runs_configs_df = None
+        if have_cache:
+            cached_runs_configs_df = pd.read_parquet(runs_configs_df_path)
+            # Only fetch runs that are new or changed since the previous download.
+            filters['updatedAt'] = {'$gt': cached_runs_configs_df['fetched_at'].max()}
+
+        # Step back from now to tolerate clock skew with the W&B server. Runs
+        # fetched twice because of the overlap are deduplicated by run_id below.
+        fetched_at = (datetime.datetime.utcnow() - datetime.timedelta(minutes=5)).strftime(
+            '%Y-%m-%dT%H:%M:%S')
 
         # Download sweep results
         api = wandb.Api(timeout=60)
 
         # Project is specified by <entity/project-name>
         if sweep_ids is None:
-            runs = api.runs(path=wandb_project_path)
+            runs = list(api.runs(path=wandb_project_path,
+                                 filters=filters,
+                                 per_page=500))
         else:
             runs = []
             for sweep_id in sweep_ids:
                 runs.extend(api.runs(path=wandb_project_path,
-                                     filters={"Sweep": sweep_id}))
+                                     filters={'sweep': sweep_id, **filters},
+                                     per_page=500))
 
-        sweep_results_list = []
-        for run in runs:
-            # .summary contains the output keys/values for metrics like accuracy.
-            #  We call ._json_dict to omit large files
-            summary = run.summary._json_dict
+        # Accumulate columns directly, rather than a list of per-run dicts, so that
+        # pandas can build each column in one pass. Runs lacking a key get None.
+        num_runs = len(runs)
+        sweep_results_columns = defaultdict(lambda: [None] * num_runs)
+        for run_idx, run in enumerate(runs):
+            # .summaryMetrics contains the output keys/values for metrics like accuracy,
+            #  and is already loaded with the run, so it costs no extra request.
+            summary = dict(run.summaryMetrics)
 
             # .config contains the hyperparameters.
             #  We remove special values that start with _.
@@ -43,17 +74,27 @@ def download_wandb_project_runs_configs(wandb_project_path: str,
 
             summary.update({'State': run.state,
                             'Sweep': run.sweep.id if run.sweep is not None else None,
-                            'run_id': run.id})
+                            'run_id': run.id,
+                            'fetched_at': fetched_at})
             # .name is the human-readable name of the run.
             summary.update({'run_name': run.name})
-            sweep_results_list.append(summary)
+            for key, value in summary.items():
+                sweep_results_columns[key][run_idx] = value
+
+        runs_configs_df = pd.DataFrame(dict(sweep_results_columns))
 
-        runs_configs_df = pd.DataFrame(sweep_results_list)
+        if cached_runs_configs_df is not None:
+            # Fetched rows replace their cached versions.
+            runs_configs_df = pd.concat([cached_runs_configs_df, runs_configs_df],
+                                        ignore_index=True)
+            runs_configs_df = runs_configs_df.drop_duplicates(
+                subset='run_id', keep='last').reset_index(drop=True)
+            print(f'Fetched {num_runs} new or updated runs.')
 
-        runs_configs_df.to_csv(runs_configs_df_path, index=False)
+        runs_configs_df.to_parquet(runs_configs_df_path, index=False, compression='zstd')
         print(f'Wrote {runs_configs_df_path} to disk.')
     else:
-        runs_configs_df = pd.read_csv(runs_configs_df_path)
+        runs_configs_df = pd.read_parquet(runs_configs_df_path)
         print(f'Loaded {runs_configs_df_path} from disk.')
 
     # Keep only finished runs
@@ -123,13 +164,50 @@ def download_wandb_project_runs_histories(wandb_project_path: str,
     return runs_histories_df
 
 
+def _load_cluster_assignments(inf_alg_results_joblib_path: str) -> Union[None, Dict[str, np.ndarray]]:
+    """
+    Load only the inferred and true cluster assignments from a results file, so that
+    the rest of the file can be garbage-collected. Returns None if the file could not be
+    loaded.
+    """
+    try:
+        joblib_file = joblib.load(inf_alg_results_joblib_path)
+    except TypeError:
+        # Sometimes, the W&B path is NaN; don't know why. This throws a
+        # TypeError: join() argument must be str or bytes, not 'float'
+        # Just log these and continue
+        print(f'Error: could not load {inf_alg_results_joblib_path}')
+        return None
+
+    # Obtain inferred cluster assignments
+    try:
+        cluster_assignment_posteriors = joblib_file['inference_alg_results'][
+            'cluster_assignment_posteriors']
+        inferred_cluster_assignments = cluster_assignment_posteriors.argmax(axis=1)
+    except KeyError:
+        # TODO: What to do for collapsed Gibbs sampling?
+        # cluster_assignment_posteriors = np.mean(
+        #     joblib_file['inference_alg_results']['cluster_assignments_one_hot_mcmc_samples'],
+        #     axis=0)
+        return dict(inferred_cluster_assignments=None,
+                    true_cluster_assignments=None)
+
+    # Obtain true cluster assignments
+    if 'true_cluster_assignments' in joblib_file:
+        true_cluster_assignments = joblib_file['true_cluster_assignments']
+    elif 'mixture_model_results' in joblib_file:
+        true_cluster_assignments = joblib_file['mixture_model_results']['cluster_assignments']
+    else:
+        raise NotImplementedError
+
+    # Copy to ensure that Python can garbage-collect the joblib file pointers
+    return dict(inferred_cluster_assignments=inferred_cluster_assignments,
+                true_cluster_assignments=np.copy(true_cluster_assignments))
+
+
 def generate_and_save_cluster_ratio_data(all_inf_algs_results_df: pd.DataFrame,
                                          sweep_results_dir_path: str):
 
-    num_inferred_clusters_div_num_true_clusters_by_obs_idx = dict()
-    num_inferred_clusters_div_total_num_true_clusters_by_obs_idx = dict()
-    num_true_clusters_div_total_num_true_clusters_by_obs_idx = dict()
-
     num_inferred_clusters_div_num_true_clusters_by_obs_idx_df_path = os.path.join(
         sweep_results_dir_path,
         'num_inferred_clusters_div_num_true_clusters_by_obs_idx.csv')
@@ -144,74 +222,60 @@ def generate_and_save_cluster_ratio_data(all_inf_algs_results_df: pd.DataFrame,
             or not os.path.isfile(num_inferred_clusters_div_total_num_true_clusters_by_obs_idx_df_path) \
             or not os.path.isfile(num_true_clusters_div_total_num_true_clusters_by_obs_idx_df_path):
 
-        num_failed_loads = 0
-
-        for inf_alg_results_joblib_path in all_inf_algs_results_df['inf_alg_results_path']:
-
-            try:
-                joblib_file = joblib.load(inf_alg_results_joblib_path)
-            except TypeError:
-                # Sometimes, the W&B path is NaN; don't know why. This throws a
-                # TypeError: join() argument must be str or bytes, not 'float'
-                # Just log these and continue
-                print(f'Error: could not load {inf_alg_results_joblib_path}')
-                num_failed_loads += 1
-                continue
-
-            # Obtain number of inferred clusters
-            try:
-                cluster_assignment_posteriors = joblib_file['inference_alg_results'][
-                    'cluster_assignment_posteriors']
-            except KeyError:
-                # TODO: What to do for collapsed Gibbs sampling?
-                # cluster_assignment_posteriors = np.mean(
-                #     joblib_file['inference_alg_results']['cluster_assignments_one_hot_mcmc_samples'],
-                #     axis=0)
-                continue
-            inferred_cluster_assignments = cluster_assignment_posteriors.argmax(axis=1)
-            num_inferred_clusters_by_obs_idx = np.array([
-                len(np.unique(inferred_cluster_assignments[:i + 1]))
-                for i in range(len(inferred_cluster_assignments))])
-
-            # Obtain numbers of observed and total true clusters
-            if 'true_cluster_assignments' in joblib_file:
-                true_cluster_assignments = joblib_file['true_cluster_assignments']
-            elif 'mixture_model_results' in joblib_file:
-                true_cluster_assignments = joblib_file['mixture_model_results']['cluster_assignments']
-            else:
-                raise NotImplementedError
-
-            num_true_clusters_by_obs_idx = np.array([
-                len(np.unique(true_cluster_assignments[:i + 1]))
-                for i in range(len(true_cluster_assignments))])
-
+        # Loading is dominated by unpickling, so load in parallel threads and keep
+        # only the cluster assignments from each results file.
+        inf_alg_results_joblib_paths = all_inf_algs_results_df['inf_alg_results_path'].tolist()
+        loaded_cluster_assignments = joblib.Parallel(n_jobs=-1, prefer='threads')(
+            joblib.delayed(_load_cluster_assignments)(inf_alg_results_joblib_path)
+            for inf_alg_results_joblib_path in inf_alg_results_joblib_paths)
+
+        num_failed_loads = sum(cluster_assignments is None
+                               for cluster_assignments in loaded_cluster_assignments)
+        # Keep runs whose files loaded and have cluster assignment posteriors.
+        loaded_paths_and_cluster_assignments = [
+            (inf_alg_results_joblib_path, cluster_assignments)
+            for inf_alg_results_joblib_path, cluster_assignments in zip(
+                inf_alg_results_joblib_paths, loaded_cluster_assignments)
+            if cluster_assignments is not None
+            and cluster_assignments['inferred_cluster_assignments'] is not None]
+        num_runs = len(loaded_paths_and_cluster_assignments)
+        if num_runs == 0:
+            raise ValueError(
+                f'None of the {len(inf_alg_results_joblib_paths)} inference results files loaded '
+                f'with cluster assignment posteriors ({num_failed_loads} failed to load).')
+        num_obs =loaded_paths_and_cluster_assignments[0][1]['true_cluster_assignments'].shape[0]
+
+        # Shape: (num runs, 3, num obs). The 3 ratios are, in order:
+        # num inferred / num true, num inferred / total num true, num true / total num true
+        cluster_ratios = np.empty(shape=(num_runs, 3, num_obs))
+        for run_idx, (_, cluster_assignments) in enumerate(loaded_paths_and_cluster_assignments):
+            true_cluster_assignments = cluster_assignments['true_cluster_assignments']
+
+            # Obtain numbers of inferred, observed and total true clusters
+            num_inferred_clusters_by_obs_idx = compute_running_num_unique(
+                cluster_assignments['inferred_cluster_assignments'])
+            num_true_clusters_by_obs_idx = compute_running_num_unique(
+                true_cluster_assignments)
             num_total_true_clusters = np.max(true_cluster_assignments)
-            num_obs = true_cluster_assignments.shape[0]
-
-            # Copy to ensure that Python can garbage-collect the joblib file pointers
-            num_inferred_clusters_div_num_true_clusters_by_obs_idx[inf_alg_results_joblib_path] = \
-                np.copy(num_inferred_clusters_by_obs_idx / num_true_clusters_by_obs_idx)
-            num_inferred_clusters_div_total_num_true_clusters_by_obs_idx[inf_alg_results_joblib_path] = \
-                np.copy(num_inferred_clusters_by_obs_idx / num_total_true_clusters)
-            num_true_clusters_div_total_num_true_clusters_by_obs_idx[inf_alg_results_joblib_path] = \
-                np.copy(num_true_clusters_by_obs_idx / num_total_true_clusters)
-
-        # Each column name is an inf_alg_results_joblib_path
-        # We want to transpose, then change the index to a column.
+
+            cluster_ratios[run_idx, 0] = num_inferred_clusters_by_obs_idx / num_true_clusters_by_obs_idx
+            cluster_ratios[run_idx, 1] = num_inferred_clusters_by_obs_idx / num_total_true_clusters
+            cluster_ratios[run_idx, 2] = num_true_clusters_by_obs_idx / num_total_true_clusters
+
+        # Each row is an inf_alg_results_joblib_path; change the index to a column.
         # The resulting dataframes have column 1 with name inf_alg_results_path and the
-        # remaining column names 0, 1, 2, ...
-        num_inferred_clusters_div_num_true_clusters_by_obs_idx_df = pd.DataFrame.from_records(
-                num_inferred_clusters_div_num_true_clusters_by_obs_idx,
-                index=1 + np.arange(num_obs),
-            ).T.rename_axis('inf_alg_results_path').reset_index()
-        num_inferred_clusters_div_total_num_true_clusters_by_obs_idx_df = pd.DataFrame.from_records(
-                num_inferred_clusters_div_total_num_true_clusters_by_obs_idx,
-                index=1 + np.arange(num_obs),
-            ).T.rename_axis('inf_alg_results_path').reset_index()
-        num_true_clusters_div_total_num_true_clusters_by_obs_idx_df = pd.DataFrame.from_records(
-                num_true_clusters_div_total_num_true_clusters_by_obs_idx,
-                index=1 + np.arange(num_obs)
-            ).T.rename_axis('inf_alg_results_path').reset_index()
+        # remaining column names 1, 2, 3, ...
+        loaded_paths = [inf_alg_results_joblib_path
+                        for inf_alg_results_joblib_path, _ in loaded_paths_and_cluster_assignments]
+        num_inferred_clusters_div_num_true_clusters_by_obs_idx_df, \
+            num_inferred_clusters_div_total_num_true_clusters_by_obs_idx_df, \
+            num_true_clusters_div_total_num_true_clusters_by_obs_idx_df = [
+                pd.DataFrame(
+                    cluster_ratios[:, ratio_idx],
+                    index=loaded_paths,
+                    columns=1 + np.arange(num_obs),
+                ).rename_axis('inf_alg_results_path').reset_index()
+                for ratio_idx in range(3)]
 
         # Save dataframes
         num_inferred_clusters_div_num_true_clusters_by_obs_idx_df.to_csv(
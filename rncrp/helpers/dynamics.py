@@ -1,4 +1,5 @@
 import abc
+import math
 import numpy as np
 import torch
 from typing import Dict
@@ -108,8 +109,9 @@ class LinearFirstOrderTorch(Dynamics):
                          time: float,
                          ) -> Dict[str, torch.Tensor]:
         del time
+        # Copy so that later in-place updates to N don't modify the caller's tensor.
         self._state = {
-            'N': customer_assignment_probs}
+            'N': customer_assignment_probs.clone()}
         return self._state
 
     def run_dynamics(self,
@@ -117,7 +119,7 @@ class LinearFirstOrderTorch(Dynamics):
                      time_end: float) -> Dict[str, torch.Tensor]:
         assert time_start < time_end
         time_delta = time_end - time_start
-        exp_change = torch.exp(- self.params['b'] * time_delta / self.params['a'])
+        exp_change = math.exp(- self.params['b'] * time_delta / self.params['a'])
         self._state['N'] = exp_change * self._state['N']
         return self._state
 
@@ -243,14 +245,8 @@ class HarmonicOscillatorTorch(Dynamics):
                          customer_assignment_probs: torch.Tensor,
                          time: float,
                          ) -> Dict[str, torch.Tensor]:
-        cos_coeff = 0.5 * torch.multiply(
-            torch.cos(torch.full_like(customer_assignment_probs,
-                                      fill_value=self.params['omega'] * time)),
-            customer_assignment_probs)
-        sin_coeff = 0.5 * torch.multiply(
-            torch.sin(torch.full_like(customer_assignment_probs,
-                                      fill_value=self.params['omega'] * time)),
-            customer_assignment_probs)
+        cos_coeff = 0.5 * math.cos(self.params['omega'] * time) * customer_assignment_probs
+        sin_coeff = 0.5 * math.sin(self.params['omega'] * time) * customer_assignment_probs
         const_coeff = 0.5 * customer_assignment_probs
         self._state = {
             'cos_coeffs': cos_coeff,
@@ -298,14 +294,10 @@ class HarmonicOscillatorTorch(Dynamics):
 
     def update_state(self,
                      customer_assignment_probs: torch.Tensor,
-                     time: torch.Tensor,
+                     time: float,
                      ) -> Dict[str, torch.Tensor]:
-        new_cos_coeff = 0.5 * torch.multiply(
-            torch.cos(self.params['omega'] * time),
-            customer_assignment_probs)
-        new_sin_coeff = 0.5 * torch.multiply(
-            torch.sin(self.params['omega'] * time),
-            customer_assignment_probs)
+        new_cos_coeff = 0.5 * math.cos(self.params['omega'] * time) * customer_assignment_probs
+        new_sin_coeff = 0.5 * math.sin(self.params['omega'] * time) * customer_assignment_probs
         new_const_coeff = 0.5 * customer_assignment_probs
         self._state['cos_coeffs'] += new_cos_coeff
         self._state['sin_coeffs'] += new_sin_coeff
@@ -314,10 +306,11 @@ class HarmonicOscillatorTorch(Dynamics):
         return self._state
 
     def _add_N_to_state(self,
-                        time: torch.Tensor):
-        N = self._state['const_coeffs']
-        N += self._state['cos_coeffs'] * torch.cos(self.params['omega'] * time)
-        N += self._state['sin_coeffs'] * torch.sin(self.params['omega'] * time)
+                        time: float):
+        # Don't accumulate in place; N would alias (and corrupt) const_coeffs.
+        N = self._state['const_coeffs'] \
+            + self._state['cos_coeffs'] * math.cos(self.params['omega'] * time) \
+            + self._state['sin_coeffs'] * math.sin(self.params['omega'] * time)
 
         # sometimes, floating point errors will give N values like -9.18e-17
         # This will break the code if we use these values to sample from a Categorical,
@@ -358,11 +351,13 @@ class HyperbolicNumpy(Dynamics):
                          time: float,
                          ) -> Dict[str, np.ndarray]:
 
-        exponential_Ns = np.repeat(customer_assignment_probs[np.newaxis, :],
+        # Shape: (num exponentials, ...) where ... is the shape of customer_assignment_probs,
+        # which may have leading batch dimensions.
+        exponential_Ns = np.repeat(customer_assignment_probs[np.newaxis, ...],
                                    repeats=self.params['num_exponentials'],
                                    axis=0)
 
-        N_weighted_avg = np.matmul(self._probabilities, exponential_Ns)
+        N_weighted_avg = np.tensordot(self._probabilities, exponential_Ns, axes=1)
         self._state = {
             'N': N_weighted_avg,
             'exponential_Ns': exponential_Ns}
@@ -373,9 +368,13 @@ class HyperbolicNumpy(Dynamics):
                      time_end: float) -> Dict[str, np.ndarray]:
         assert time_start < time_end
         exp_change = np.exp(- self._exponential_rates * (time_end - time_start))
+        # Broadcast over any batch dimensions of the state.
+        exp_change = exp_change.reshape(
+            (-1,) + (1,) * (self._state['exponential_Ns'].ndim - 1))
         self._state['exponential_Ns'] *= exp_change
-        self._state['N'] = np.matmul(self._probabilities,
-                                     self._state['exponential_Ns'])
+        self._state['N'] = np.tensordot(self._probabilities,
+                                        self._state['exponential_Ns'],
+                                        axes=1)
         return self._state
 
     def update_state(self,
@@ -383,9 +382,10 @@ class HyperbolicNumpy(Dynamics):
                      time: float,
                      ) -> Dict[str, np.ndarray]:
 
-        self._state['exponential_Ns'] += customer_assignment_probs[np.newaxis, :]
-        self._state['N'] = np.matmul(self._probabilities,
-                                     self._state['exponential_Ns'])
+        self._state['exponential_Ns'] += customer_assignment_probs[np.newaxis, ...]
+        self._state['N'] = np.tensordot(self._probabilities,
+                                        self._state['exponential_Ns'],
+                                        axes=1)
         return self._state
 
 
@@ -418,9 +418,13 @@ class HyperbolicTorch(Dynamics):
 
     def initialize_state(self,
                          customer_assignment_probs: torch.Tensor,
-                         time: torch.Tensor,
+                         time: float,
                          ) -> Dict[str, torch.Tensor]:
 
+        # Keep the quadrature constants on the same device as the state.
+        self._exponential_rates = self._exponential_rates.to(customer_assignment_probs.device)
+        self._weights = self._weights.to(customer_assignment_probs.device)
+
         # Shape: (num exponentials, max num clusters)
         exponential_Ns = customer_assignment_probs[np.newaxis, :].repeat(
             self.params['num_exponentials'], 1)
@@ -432,8 +436,8 @@ class HyperbolicTorch(Dynamics):
         return self._state
 
     def run_dynamics(self,
-                     time_start: torch.Tensor,
-                     time_end: torch.Tensor,
+                     time_start: float,
+                     time_end: float,
                      ) -> Dict[str, torch.Tensor]:
         assert time_start < time_end
         exp_change = torch.exp(- self._exponential_rates * (time_end - time_start))
@@ -443,13 +447,13 @@ class HyperbolicTorch(Dynamics):
         return self._state
 
     def update_state(self,
-                     customer_assignment_probs: np.ndarray,
+                     customer_assignment_probs: torch.Tensor,
                      time: float,
-                     ) -> Dict[str, np.ndarray]:
+                     ) -> Dict[str, torch.Tensor]:
 
         self._state['exponential_Ns'] += customer_assignment_probs[np.newaxis, :]
-        self._state['N'] = np.matmul(self._weights,
-                                     self._state['exponential_Ns'])
+        self._state['N'] = torch.matmul(self._weights,
+                                        self._state['exponential_Ns'])
         return self._state
 
 
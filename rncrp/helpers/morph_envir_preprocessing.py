@@ -126,7 +126,7 @@ def centroid_diff_perm_test(centroid_diff,S_trial_mat,trial_info,nperms=1000):
         _morph = morphs_ext[np.random.permutation(morphs_ext.shape[0])]
         centroid_diff_shuff[:,p] = np.mean((S_trial_mat_ext[_morph==0,:,:].mean(axis=0)-S_trial_mat_ext[_morph==1,:,:].mean(axis=0))**2,axis=0)
         
-    return np.array(centroid_diff[:,np.newaxis]<centroid_diff_shuff,dtype=np.float).mean(axis=1)
+    return np.array(centroid_diff[:,np.newaxis]<centroid_diff_shuff,dtype=float).mean(axis=1)
 
 
 def regress_distance(dist,morphs,x = np.linspace(-.1,1.1,num=50)) :
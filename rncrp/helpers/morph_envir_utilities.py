@@ -472,12 +472,12 @@ def smooth_raster(x,mat,ax=None,smooth=False,sig=2,vals=None,cmap='cool',tports=
 
     for ind,i in enumerate(np.arange(mat.shape[0]-1,0,-1)):
         if vals is not None:
-            ax.fill_between(x,mat[ind,:]+i,y2=i,color=cm(np.float(vals[ind])),linewidth=.001)
+            ax.fill_between(x,mat[ind,:]+i,y2=i,color=cm(float(vals[ind])),linewidth=.001)
         else:
             ax.fill_between(x,mat[ind,:]+i,y2=i,color = 'black',linewidth=.001)
 
         if tports is not None:
-            ax.scatter(tports[ind],i+.5,color=cm(np.float(vals[ind])),marker='x',s=50)
+            ax.scatter(tports[ind],i+.5,color=cm(float(vals[ind])),marker='x',s=50)
 
     ax.set_yticks(np.arange(0,mat.shape[0],10))
     ax.set_yticklabels(["%d" % l for l in np.arange(mat.shape[0],0,-10).tolist()])
@@ -29,7 +29,7 @@ def compute_largest_dish_idx(observations: np.ndarray,
     """
 
     observations_copy = np.copy(observations)
-    observations_copy = observations_copy.astype(np.float)
+    observations_copy = observations_copy.astype(float)
     column_sums = np.sum(observations >= cutoff, axis=0)
     columns_has_value_gt_cutoff = column_sums > 0
     false_columns = np.argwhere(columns_has_value_gt_cutoff == False)
@@ -39,6 +39,19 @@ def compute_largest_dish_idx(observations: np.ndarray,
         return false_columns[0, 0]
 
 
+def convert_cluster_assignments_to_one_hot(cluster_assignments: np.ndarray,
+                                           num_clusters: int = None) -> np.ndarray:
+    """
+    Convert integer cluster assignments of any shape to one-hot vectors along a
+    new trailing axis of size num_clusters.
+    """
+    if num_clusters is None:
+        num_clusters = np.max(cluster_assignments) + 1
+    one_hot = np.zeros(shape=cluster_assignments.shape + (num_clusters,))
+    np.put_along_axis(one_hot, cluster_assignments[..., np.newaxis], 1., axis=-1)
+    return one_hot
+
+
 def convert_half_cov_to_cov(half_cov: np.ndarray) -> np.ndarray:
     """
     Converts half-covariance M into covariance M^T M in a batched manner.
@@ -70,6 +83,18 @@ def convert_half_cov_to_cov(half_cov: np.ndarray) -> np.ndarray:
     return cov
 
 
+def compute_running_num_unique(x: np.ndarray) -> np.ndarray:
+    """
+    Compute the number of unique values in x[:i+1] for every i, i.e. the cumulative
+    count of first occurrences.
+
+    Array assumed to have shape (num obs, )
+    """
+    is_first_occurrence = np.zeros(x.shape[0], dtype=bool)
+    is_first_occurrence[np.unique(x, return_index=True)[1]] = True
+    return np.cumsum(is_first_occurrence)
+
+
 def logits_to_probs(logits):
     probs = 1. / (1. + np.exp(-logits))
     return probs
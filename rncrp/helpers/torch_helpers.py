@@ -1,7 +1,9 @@
 import logging
+import math
 
 import numpy as np
 import torch
+from typing import Tuple
 
 
 def assert_torch_no_nan_no_inf_is_real(x):
@@ -92,38 +94,46 @@ def expected_log_gaussian_under_gaussian(p_mean: torch.Tensor,
     # gaussian_dim = p_mean.shape[-1]
     batch_dim = p_mean.shape[0]
 
-    # sum_k -0.5 * log (2 pi |p_cov|)
-    term_one = -0.5 * torch.sum(torch.log(2 * np.pi * torch.linalg.det(p_cov)))
+    # Factor p_cov once. The Cholesky factor gives both the log determinant
+    # and solves against p_cov, so the precision is never formed explicitly.
+    p_cov_chol = torch.linalg.cholesky(p_cov)
 
-    p_precision = torch.linalg.inv(p_cov)  # recall, precision = cov^{-1}
+    # sum_k -0.5 * log (2 pi |p_cov|)
+    log_det_p_cov = 2. * torch.sum(
+        torch.log(torch.diagonal(p_cov_chol, dim1=-2, dim2=-1)),
+        dim=-1)
+    term_one = -0.5 * torch.sum(np.log(2 * np.pi) + log_det_p_cov)
 
     # sum_k -0.5 Tr[p_precision (q_cov + q_mean q_mean^T)]
     term_two = -0.5 * torch.sum(
         torch.einsum(
             'bii->b',
-            torch.einsum(
-                'bij, bjk->bik',
-                p_precision,
+            torch.cholesky_solve(
                 q_cov + torch.einsum('bi, bj->bij',
                                      q_mean,
-                                     q_mean))))
+                                     q_mean),
+                p_cov_chol)))
+
+    # Precision_p mean_p. Shape: (batch, dim)
+    p_precision_p_mean = torch.cholesky_solve(p_mean[:, :, None], p_cov_chol)[:, :, 0]
 
     # sum_k -0.5 * -2 * mean_p Precision_p mean_q
     term_three = -0.5 * -2. * torch.einsum(
-        'bi,bij,bj',
-        p_mean,
-        p_precision,
+        'bi,bi',
+        p_precision_p_mean,
         q_mean,
     )
 
     # sum_k -0.5 * mean_p Precision_p mean_p
     term_four = -0.5 * -2. * torch.einsum(
-        'bi,bij,bj',
-        p_mean,
-        p_precision,
+        'bi,bi',
+        p_precision_p_mean,
         p_mean,
     )
     if check_einsums:
+        p_precision = torch.cholesky_solve(
+            torch.eye(p_cov.shape[-1], dtype=p_cov.dtype, device=p_cov.device).expand_as(p_cov),
+            p_cov_chol)
         term_two_check = -0.5 * torch.sum(torch.stack(
             [torch.trace(torch.matmul(p_precision[k],
                                       torch.add(q_cov[k],
@@ -149,6 +159,27 @@ def expected_log_gaussian_under_gaussian(p_mean: torch.Tensor,
     return total
 
 
+@torch.jit.script
+def expected_log_isotropic_gaussian_likelihood(observation: torch.Tensor,
+                                               means: torch.Tensor,
+                                               precisions: torch.Tensor,
+                                               sigma_obs_squared: float) -> torch.Tensor:
+    """
+    Compute E_{q(phi_k)}[log N(o; phi_k, sigma_obs^2 I)] for each cluster k, where
+    q(phi_k) = N(mean_k, I / precision_k).
+
+    means has shape (K, D) and precisions has shape (K, 1). Returns shape (K,).
+    """
+    obs_dim = observation.shape[0]
+
+    # -(||o - mu_k||^2 + Tr[Sigma_k]) / 2 sigma_obs^2, with Tr[Sigma_k] = D / precision_k
+    expected_sq_dist = torch.sum(torch.square(observation - means), dim=1) \
+        + obs_dim * torch.reciprocal(precisions[:, 0])
+
+    return -0.5 * expected_sq_dist / sigma_obs_squared \
+        - 0.5 * obs_dim * math.log(2. * math.pi * sigma_obs_squared)
+
+
 def expected_log_gaussian_under_linear_gaussian(observation: torch.Tensor,
                                                 q_A_mean: torch.Tensor,
                                                 q_A_cov: torch.Tensor,
@@ -165,38 +196,28 @@ def expected_log_gaussian_under_linear_gaussian(observation: torch.Tensor,
     num_features = q_A_mean.shape[0]
 
     # -0.5 * log (2 * pi * |sigma_o^2 I|)
-    term_one = -0.5 * torch.log(
-        2 * np.pi * torch.linalg.det(sigma_obs_squared * torch.eye(obs_dim)))
+    term_one = -0.5 * (np.log(2 * np.pi) + obs_dim * np.log(sigma_obs_squared))
 
     # o^T o
     term_two = torch.inner(observation, observation)
 
     # -2. * E[z_n] E[A_n]^T o
-    term_three = -2. * torch.einsum(
-        'b, bd, d->',
-        q_Z_mean,
-        q_A_mean,
-        observation)
+    term_three = -2. * torch.inner(q_Z_mean, torch.mv(q_A_mean, observation))
 
     # \sum_k b_{nk} Tr[Sigma_{nk} + \mu_{nk} \mu_{nk}^T]
-    term_four = torch.einsum(
-        'b,b->',
+    # Tr[\mu \mu^T] = \mu^T \mu, so the outer products are never formed.
+    term_four = torch.inner(
         q_Z_mean,
-        torch.einsum('bii->b', q_A_cov + torch.einsum('bi, bj->bij',
-                                                      q_A_mean,
-                                                      q_A_mean)))
+        torch.diagonal(q_A_cov, dim1=-2, dim2=-1).sum(dim=-1)
+        + torch.sum(torch.square(q_A_mean), dim=-1))
 
     # \sum_{k, k': k \neq k'} b_{nk} b_{nk'} \mu_{nk}^T \mu_{nk'}]
-    # I don't know how to exclude the k=k' elements in the double sum, so we'll subtract
-    # those using another einsum
-    term_five_all_pairs = torch.einsum(
-        'i,j,ik,jk->ij',
-        q_Z_mean,
-        q_Z_mean,
-        q_A_mean,
-        q_A_mean)
-    term_five_self_pairs = torch.trace(term_five_all_pairs)
-    term_five = torch.sum(term_five_all_pairs) - term_five_self_pairs
+    # All pairs sum to ||\sum_k b_{nk} \mu_{nk}||^2; subtract the k=k' pairs.
+    # Shape: (num features, obs dim)
+    weighted_q_A_mean = q_Z_mean[:, None] * q_A_mean
+    term_five_all_pairs_sum = torch.sum(torch.square(torch.sum(weighted_q_A_mean, dim=0)))
+    term_five_self_pairs = torch.sum(torch.square(weighted_q_A_mean))
+    term_five = term_five_all_pairs_sum - term_five_self_pairs
 
     if check_einsums:
         term_three_check = -2. * torch.sum(torch.multiply(q_Z_mean,
@@ -215,9 +236,9 @@ def expected_log_gaussian_under_linear_gaussian(observation: torch.Tensor,
              for kprime in range(num_features)]))
         # TODO: debug why this assertion fails on the 21st step on a subset of datasets
         try:
-            assert torch.isclose(torch.sum(term_five_all_pairs), term_five_all_pairs_sum_check)
+            assert torch.isclose(term_five_all_pairs_sum, term_five_all_pairs_sum_check)
         except AssertionError:
-            logging.error(str(term_five_all_pairs - term_five_all_pairs_sum_check))
+            logging.error(str(term_five_all_pairs_sum - term_five_all_pairs_sum_check))
             raise AssertionError
 
     total = term_one - 0.5 * (term_two + term_three + term_four + term_five) / sigma_obs_squared
@@ -225,6 +246,53 @@ def expected_log_gaussian_under_linear_gaussian(observation: torch.Tensor,
     return total
 
 
+@torch.jit.script
+def update_isotropic_gaussian_posterior(prev_means: torch.Tensor,
+                                        prev_precisions: torch.Tensor,
+                                        probs: torch.Tensor,
+                                        observation: torch.Tensor,
+                                        sigma_obs_squared: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Condition each q(phi_k) = N(mean_k, I / precision_k) on observation o,
+    weighted by q(c_n = k), under the likelihood N(o; phi_k, sigma_obs^2 I).
+
+    prev_means has shape (K, D), prev_precisions has shape (K, 1) and probs has
+    shape (K,). Returns the new means and new precisions.
+    """
+    # Shape: (K, 1)
+    added_precisions = probs[:, None] / sigma_obs_squared
+    new_precisions = prev_precisions + added_precisions
+
+    # Sigma_k (Sigma_{k, prev}^{-1} mu_{k, prev} + q(c_n = k) o / sigma_obs^2)
+    new_means = (prev_means * prev_precisions + added_precisions * observation) \
+                / new_precisions
+
+    return new_means, new_precisions
+
+
+@torch.jit.script
+def update_vonmisesfisher_posterior(prev_means: torch.Tensor,
+                                    prev_concentrations: torch.Tensor,
+                                    probs: torch.Tensor,
+                                    observation: torch.Tensor,
+                                    likelihood_kappa: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Condition each q(phi_k) = vMF(mean_k, concentration_k) on observation o,
+    weighted by q(c_n = k), under the likelihood vMF(o; phi_k, likelihood_kappa).
+
+    prev_means has shape (K, D), prev_concentrations has shape (K, 1) and probs
+    has shape (K,). Returns the new mean directions and new concentrations.
+    """
+    # kappa_k mu_k + likelihood_kappa q(c_n = k) o. Shape: (K, D)
+    rhs = prev_concentrations * prev_means + likelihood_kappa * probs[:, None] * observation
+
+    # Shape: (K, 1)
+    new_concentrations = torch.norm(rhs, dim=1, keepdim=True)
+    new_means = rhs / new_concentrations
+
+    return new_means, new_concentrations
+
+
 def entropy_bernoulli(probs: torch.Tensor) -> torch.Tensor:
     """
     Compute entropy of p(x) = Bernoulli(prob).
@@ -283,3 +351,25 @@ def probs_to_logits(probs):
 def torch_round(x: torch.Tensor, decimals=0) -> torch.Tensor:
     b = 10**decimals
     return torch.round(x * b) / b
+
+
+@torch.jit.script
+def update_num_clusters_posterior(prev_num_clusters_posterior: torch.Tensor,
+                                  cluster_assignment_posterior: torch.Tensor,
+                                  num_clusters_posterior: torch.Tensor) -> None:
+    """
+    Compute p(K_t = k) from p(K_{t-1} = k) and q(z_t), in time O(t).
+
+    If customer t sits at an existing table (index < k), the number of clusters
+    stays at k; otherwise, it grows to k + 1.
+
+    prev_num_clusters_posterior has shape (t,) and cluster_assignment_posterior
+    has shape (t + 1,). The result is written in place into num_clusters_posterior,
+    which has shape (t + 1,) and must not alias prev_num_clusters_posterior.
+    """
+    cum_cluster_assignment_posterior = torch.cumsum(cluster_assignment_posterior[:-1], dim=0)
+    num_clusters_posterior.zero_()
+    num_clusters_posterior[:-1].addcmul_(cum_cluster_assignment_posterior, prev_num_clusters_posterior)
+    # (1 - cum) * prev, without allocating 1 - cum.
+    num_clusters_posterior[1:].add_(prev_num_clusters_posterior)
+    num_clusters_posterior[1:].addcmul_(cum_cluster_assignment_posterior, prev_num_clusters_posterior, value=-1.)
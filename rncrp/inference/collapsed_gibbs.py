@@ -1,11 +1,15 @@
+import logging
 import numpy as np
-from scipy.stats import multivariate_normal
+import scipy.special
 from sklearn.preprocessing import OneHotEncoder
 from typing import Dict
 
 from rncrp.inference.base import BaseModel
 
 
+logger = logging.getLogger(__name__)
+
+
 class CollapsedGibbsSampler(BaseModel):
     """
     Collapsed Gibbs Sampling for Dirichlet Process Gaussian Mixture Model.
@@ -86,11 +90,12 @@ class CollapsedGibbsSampler(BaseModel):
                 cluster_cov_per_cluster[-1] = self.component_prior_params['centroids_prior_cov_prefactor'] \
                                               + self.likelihood_params['likelihood_cov_prefactor']
 
-                log_likelihood_per_cluster = np.array([multivariate_normal.logpdf(
-                    observation,
-                    mean=cluster_mean_per_cluster[cluster_idx],
-                    cov=cluster_cov_per_cluster[cluster_idx] * np.eye(obs_dim))
-                    for cluster_idx in range(len(cluster_ids) + 1)])
+                # Covariances are isotropic, so evaluate log N(o; mu_k, c_k I) in closed form
+                # for all clusters at once rather than building a (D, D) covariance per cluster.
+                log_likelihood_per_cluster = -0.5 * (
+                    obs_dim * np.log(2. * np.pi * cluster_cov_per_cluster[:, 0])
+                    + np.sum(np.square(observation - cluster_mean_per_cluster), axis=1)
+                    / cluster_cov_per_cluster[:, 0])
 
                 # If there are no other points in a cluster, then the log likelihood will be NaN
                 # since the mean is NaN. Set these to negative infinity.
@@ -105,17 +110,8 @@ class CollapsedGibbsSampler(BaseModel):
 
                 log_sampling_prob_per_cluster = log_likelihood_per_cluster + log_prior_per_cluster
 
-                # For numerical stability, first subtract max.
-                log_sampling_prob_per_cluster -= np.max(log_sampling_prob_per_cluster)
-
-                # Compute softmax.
-                sampling_prob_per_cluster = np.exp(log_sampling_prob_per_cluster)
-                sampling_prob_per_cluster /= np.sum(sampling_prob_per_cluster)
-
-                try:
-                    assert np.all(~np.isnan(sampling_prob_per_cluster))
-                except AssertionError:
-                    print()
+                # Compute softmax. scipy subtracts the max for numerical stability.
+                sampling_prob_per_cluster = scipy.special.softmax(log_sampling_prob_per_cluster)
 
                 new_cluster_id = np.max(cluster_ids) + 1
                 cluster_ids_plus_new = np.concatenate([
@@ -145,14 +141,15 @@ class CollapsedGibbsSampler(BaseModel):
                 new_cluster_assignment_posteriors[cluster_assignment_posteriors == cluster_id] = cluster_idx
             cluster_assignment_posteriors = new_cluster_assignment_posteriors.copy()
 
-            print(f'Pass: {pass_idx + 1}\tNum clusters: {len(cluster_ids)}\n'
-                  f'Cluster sizes: {num_obs_per_cluster[sorted_indices_by_num_obs]}')
+            logger.debug(f'Pass: {pass_idx + 1}\tNum clusters: {len(cluster_ids)}\n'
+                         f'Cluster sizes: {num_obs_per_cluster[sorted_indices_by_num_obs]}')
 
         # TODO Technically, we should recompute these, but I'm going to hope that the last
         # observation on the last pass doesn't change anything too much.
+        # Broadcast each cluster's isotropic variance against one identity.
+        # Shape: (num clusters, obs dim, obs dim)
         params = dict(means=cluster_mean_per_cluster,
-                      covs=cluster_cov_per_cluster * np.eye(obs_dim).reshape(
-                          1, obs_dim, obs_dim).repeat(len(sampling_prob_per_cluster)))
+                      covs=cluster_cov_per_cluster[:, :, np.newaxis] * np.eye(obs_dim)[np.newaxis, :, :])
 
         num_inferred_clusters = len(np.unique(cluster_assignment_posteriors))
 
@@ -1,6 +1,7 @@
+import logging
 import numpy as np
+import scipy.special
 import scipy.stats
-from scipy.stats import multivariate_normal
 from sklearn.preprocessing import OneHotEncoder
 from typing import Dict
 
@@ -8,6 +9,9 @@ from rncrp.inference.base import BaseModel
 from rncrp.helpers.numpy_helpers import assert_np_no_nan_no_inf_is_real
 
 
+logger = logging.getLogger(__name__)
+
+
 class State(object):
 
     def __init__(self,
@@ -108,7 +112,7 @@ class CollapsedGibbsSamplerNew(BaseModel):
         for step_idx in range(self.total_steps):
 
             if step_idx % 100 == 0:
-                print(f'Monte Carlo State Idx: {step_idx}')
+                logger.debug(f'Monte Carlo State Idx: {step_idx}')
 
             # Modifies state in-place.
             self.gibbs_step(observations=observations,
@@ -245,11 +249,12 @@ class CollapsedGibbsSamplerNew(BaseModel):
         # plt.legend()
         # plt.show()
 
-        log_likelihood_per_cluster = np.array([multivariate_normal.logpdf(
-            observations[obs_idx],
-            mean=cluster_mean_per_cluster[cluster_idx],
-            cov=cluster_cov_per_cluster[cluster_idx] * np.eye(observations.shape[1]))
-            for cluster_idx in range(len(cluster_ids) + 1)])
+        # Covariances are isotropic, so evaluate log N(o; mu_k, c_k I) in closed form
+        # for all clusters at once rather than building a (D, D) covariance per cluster.
+        log_likelihood_per_cluster = -0.5 * (
+            obs_dim * np.log(2. * np.pi * cluster_cov_per_cluster[:, 0])
+            + np.sum(np.square(observations[obs_idx] - cluster_mean_per_cluster), axis=1)
+            / cluster_cov_per_cluster[:, 0])
 
         # If there are no other points in a cluster, then the mean will be NaN and the
         # log likelihood will be NaN. Set these to negative infinity.
@@ -257,17 +262,8 @@ class CollapsedGibbsSamplerNew(BaseModel):
 
         log_sampling_prob_per_cluster = log_likelihood_per_cluster + log_prior_per_cluster
 
-        # For numerical stability, first subtract max.
-        # log_sampling_prob_per_cluster -= np.max(log_sampling_prob_per_cluster)
-
-        # Compute softmax.
-        sampling_prob_per_cluster = np.exp(log_sampling_prob_per_cluster)
-        sampling_prob_per_cluster /= np.sum(sampling_prob_per_cluster)
-
-        try:
-            assert np.all(~np.isnan(sampling_prob_per_cluster))
-        except AssertionError:
-            print()
+        # Compute softmax. scipy subtracts the max for numerical stability.
+        sampling_prob_per_cluster = scipy.special.softmax(log_sampling_prob_per_cluster)
 
         return sampling_prob_per_cluster
 
@@ -1,18 +1,21 @@
+import functools
+import logging
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.special
-import tensorflow_probability as tfp
-import time
 import torch
 import torch.nn.functional
 import torch.utils.data
 from typing import Callable, Dict, Union
 
-tfd = tfp.distributions
-
 from rncrp.inference.base import BaseModel
 from rncrp.helpers.dynamics import convert_dynamics_str_to_dynamics_obj
-from rncrp.helpers.torch_helpers import assert_torch_no_nan_no_inf_is_real
+from rncrp.helpers.torch_helpers import assert_torch_no_nan_no_inf_is_real, \
+    expected_log_isotropic_gaussian_likelihood, update_isotropic_gaussian_posterior, update_num_clusters_posterior, \
+    update_vonmisesfisher_posterior
+
+
+logger = logging.getLogger(__name__)
 
 
 class DynamicalCRP(BaseModel):
@@ -31,6 +34,9 @@ class DynamicalCRP(BaseModel):
                  which_prior_prob: str = 'DP',
                  update_new_cluster_parameters: bool = False,
                  max_num_clusters: int = None,
+                 device: str = 'cpu',
+                 debug: bool = False,
+                 param_dtype: torch.dtype = torch.float32,
                  **kwargs,
                  ):
         self.gen_model_params = gen_model_params
@@ -64,6 +70,14 @@ class DynamicalCRP(BaseModel):
         self.update_new_cluster_parameters = update_new_cluster_parameters
         self.robbins_monro_cavi_updates = robbins_monro_cavi_updates
         self.record_history = record_history
+        self.device = torch.device(device)
+        # NaN/Inf checks sync and scan full tensors, so only run them when debugging.
+        self.debug = debug
+        # Storage dtype for cluster means e.g. torch.bfloat16. Updates are
+        # computed in float32 and cast back on write. Parameters that accumulate
+        # counts (precisions, concentrations, Beta arguments) stay float32, since
+        # low-precision sums stop growing once the total dwarfs each increment.
+        self.param_dtype = param_dtype
         self.fit_results = None
 
         # For some likelihoods e.g. von Mises-Fisher, we can compute (log)
@@ -77,27 +91,37 @@ class DynamicalCRP(BaseModel):
 
         if isinstance(observations, np.ndarray):
             num_obs, obs_dim = observations.shape
-            torch_observations = torch.from_numpy(observations).float()
+            torch_observations = torch.from_numpy(observations).float().to(self.device)
         elif isinstance(observations, torch.utils.data.DataLoader):
-            num_obs = len(observations)
+            # The dataloader may batch observations; count observations, not batches.
+            num_obs = len(observations.dataset)
             obs_dim = observations.dataset[0]['observations'].shape[-1]
-            torch_observations = observations
+            torch_observations = self.iterate_dataloader_observations(dataloader=observations)
         else:
             raise ValueError
 
         if self.max_num_clusters is None:
             self.max_num_clusters = num_obs
 
-        torch_observations_times = torch.from_numpy(observations_times).float()
+        # Times are only used as scalars by the dynamics, so keep them as Python floats.
+        # Indexing a device tensor per observation would sync on every comparison.
+        observations_times = observations_times.astype(np.float32).tolist()
 
-        cluster_assignment_priors = torch.zeros(size=(num_obs, self.max_num_clusters),
-                                                dtype=torch.float32)
+        # The number-of-clusters recursion only reads the previous row, so unless
+        # the full history is requested, keep a rolling buffer of two rows.
+        num_history_rows = num_obs if self.record_history else 2
+
+        cluster_assignment_priors = torch.zeros(size=(num_history_rows, self.max_num_clusters),
+                                                dtype=torch.float32,
+                                                device=self.device)
 
         cum_cluster_assignment_posteriors = torch.zeros(size=(self.max_num_clusters,),
-                                                        dtype=torch.float32)
+                                                        dtype=torch.float32,
+                                                        device=self.device)
 
-        num_clusters_posteriors = torch.zeros(size=(num_obs, self.max_num_clusters),
-                                              dtype=torch.float32)
+        num_clusters_posteriors = torch.zeros(size=(num_history_rows, self.max_num_clusters),
+                                              dtype=torch.float32,
+                                              device=self.device)
 
         if self.likelihood_params['distribution'] == 'dirichlet_multinomial':
 
@@ -130,13 +154,16 @@ class DynamicalCRP(BaseModel):
                     probs=torch.full(
                         size=(num_obs, self.max_num_clusters),
                         fill_value=0.,
-                        dtype=torch.float32)),
+                        dtype=torch.float32,
+                        device=self.device)),
                 means=dict(
                     means=torch.full(
                         size=(2, self.max_num_clusters, obs_dim),
                         fill_value=0.,
-                        dtype=torch.float32),
-                    diag_covs=A_prefactor * torch.ones(2, self.max_num_clusters, obs_dim)))
+                        dtype=self.param_dtype,
+                        device=self.device),
+                    precisions=torch.ones(2, self.max_num_clusters, 1,
+                                          dtype=torch.float32, device=self.device) / A_prefactor))
 
         elif self.likelihood_params['distribution'] == 'product_bernoullis':
 
@@ -149,16 +176,19 @@ class DynamicalCRP(BaseModel):
                     probs=torch.full(
                         size=(num_obs, self.max_num_clusters),
                         fill_value=0.,
-                        dtype=torch.float32)),
+                        dtype=torch.float32,
+                        device=self.device)),
                 beta=dict(
                     arg1=torch.full(
                         size=(2, self.max_num_clusters, obs_dim),  # 2 for past & current
                         fill_value=self.component_prior_params['beta_arg1'],
-                        dtype=torch.float32),
+                        dtype=torch.float32,
+                        device=self.device),
                     arg2=torch.full(
                         size=(2, self.max_num_clusters, obs_dim),  # 2 for past & current
                         fill_value=self.component_prior_params['beta_arg2'],
                         dtype=torch.float32,
+                        device=self.device,
                     )))
 
         elif self.likelihood_params['distribution'] == 'vonmises_fisher':
@@ -172,16 +202,19 @@ class DynamicalCRP(BaseModel):
                     probs=torch.full(
                         size=(num_obs, self.max_num_clusters),
                         fill_value=0.,
-                        dtype=torch.float32)),
+                        dtype=torch.float32,
+                        device=self.device)),
                 means=dict(
                     means=torch.full(
                         size=(2, self.max_num_clusters, obs_dim),
                         fill_value=0.,
-                        dtype=torch.float32),
+                        dtype=self.param_dtype,
+                        device=self.device),
                     concentrations=torch.full(
                         size=(2, self.max_num_clusters, 1),
                         fill_value=self.likelihood_params['likelihood_kappa'],
                         dtype=torch.float32,
+                        device=self.device,
                     )))
 
 
@@ -203,24 +236,42 @@ class DynamicalCRP(BaseModel):
         else:
             raise NotImplementedError
 
+        # Reused for every observation's prior rather than allocating a new tensor.
+        cluster_assignment_prior = torch.zeros(size=(self.max_num_clusters,),
+                                               dtype=torch.float32,
+                                               device=self.device)
+
+        # Parameters stored as (previous, current) pairs along the first axis.
+        rolling_variational_params = [
+            variational_param_tensor
+            for variable, variable_variational_params_dict in variational_params.items()
+            if variable != 'assignments'
+            for variational_param_tensor in variable_variational_params_dict.values()]
+
+        # Looked up once rather than on every observation.
+        alpha = float(self.mixing_params['alpha'])
+        likelihood_params = self.gen_model_params['likelihood_params']
+
+        # Only closed-form coordinate ascent updates are implemented.
+        if self.numerically_optimize:
+            raise NotImplementedError
+
         for obs_idx, torch_observation in enumerate(torch_observations):
 
-            # Dataloader may return a dictionary. Select the observation from it.
-            if isinstance(torch_observation, dict):
-                print(f"class: {torch_observation['target'].item()}")
-                torch_observation = torch_observation['observations'][0]  # Remove the batch index
+            curr_row = obs_idx % num_history_rows
+            prev_row = (obs_idx - 1) % num_history_rows
 
             if obs_idx == 0:
 
                 # First customer always goes at first table.
-                cluster_assignment_priors[obs_idx, 0] = 1.
+                cluster_assignment_priors[curr_row, 0] = 1.
                 variational_params['assignments']['probs'][obs_idx, 0] = 1.
-                cluster_assignment_posterior = variational_params['assignments']['probs'][obs_idx, :].clone()
-                num_clusters_posteriors[obs_idx, 0] = 1.
+                cluster_assignment_posterior = variational_params['assignments']['probs'][obs_idx, :]
+                num_clusters_posteriors[curr_row, 0] = 1.
 
                 self.dynamics.initialize_state(
                     customer_assignment_probs=cluster_assignment_posterior,
-                    time=torch_observations_times[obs_idx])
+                    time=observations_times[obs_idx])
 
                 # Create parameters for each potential new cluster.
                 initialize_cluster_params_fn(torch_observation=torch_observation,
@@ -232,134 +283,101 @@ class DynamicalCRP(BaseModel):
                     obs_idx=obs_idx,
                     vi_idx=0,
                     variational_params=variational_params,
-                    likelihood_params=self.gen_model_params['likelihood_params'],
+                    likelihood_params=likelihood_params,
                     cum_cluster_assignment_posteriors=cum_cluster_assignment_posteriors)
 
                 # Overwrite old variational parameters with curr variational parameters.
-                for variable, variable_variational_params_dict in variational_params.items():
-                    if variable == 'assignments':
-                        continue
-                    for variational_param, variational_param_tensor in variable_variational_params_dict.items():
-                        variational_param_tensor[0] = variational_param_tensor[1]
+                # Only clusters up to the current observation can have changed.
+                for variational_param_tensor in rolling_variational_params:
+                    variational_param_tensor[0, :obs_idx + 1].copy_(variational_param_tensor[1, :obs_idx + 1])
 
             else:
 
                 # Step 1: Construct prior.
-                # Step 1(i): Run dynamics.
-                cluster_assignment_prior = self.dynamics.run_dynamics(
-                    time_start=torch_observations_times[obs_idx - 1],
-                    time_end=torch_observations_times[obs_idx])['N'].clone()
+                # Step 1(i): Run dynamics. Copy into the prior buffer because the prior
+                # is modified in place below. Only the first obs_idx + 1 clusters can be
+                # occupied; the rest of the buffer stays zero, so all of step 1 works on
+                # that slice.
+                cluster_assignment_prior[:obs_idx + 1].copy_(self.dynamics.run_dynamics(
+                    time_start=observations_times[obs_idx - 1],
+                    time_end=observations_times[obs_idx])['N'][:obs_idx + 1])
 
                 # Step 1(ii): Add new table probability.
-                cluster_assignment_prior[1:obs_idx + 1] += self.mixing_params['alpha'] * \
-                                                           num_clusters_posteriors[obs_idx - 1, :obs_idx].clone()
+                cluster_assignment_prior[1:obs_idx + 1].add_(num_clusters_posteriors[prev_row, :obs_idx],
+                                                              alpha=alpha)
 
                 # Step 1(iii): Normalize.
                 # print('Unnormalized cluster assignment prior: ', cluster_assignment_prior[:obs_idx + 1].numpy())
-                cluster_assignment_prior /= torch.sum(cluster_assignment_prior)
+                cluster_assignment_prior[:obs_idx + 1].div_(torch.sum(cluster_assignment_prior[:obs_idx + 1]))
                 # print('Normalized cluster assignment prior: ', cluster_assignment_prior[:obs_idx + 1].numpy())
-                assert_torch_no_nan_no_inf_is_real(cluster_assignment_prior)
+                if self.debug:
+                    assert_torch_no_nan_no_inf_is_real(cluster_assignment_prior)
 
                 # print(cluster_assignment_prior.numpy()[:obs_idx + 1])
 
                 # Step 1(iv): Sometimes, somehow, small negative numbers sneak in e.g. -2e-22
-                # Identify them, test whether they're close to 0. If they are, replace with 0.
-                # Otherwise, raise an assertion error.
-                negative_indices = cluster_assignment_prior < 0.
-                if torch.any(negative_indices):
-                    # print(f'Smallest value: {torch.min(cluster_assignment_prior)}')
-                    # If the values are sufficiently close to 0, replace with 0.
-                    # if torch.all(torch.isclose(cluster_assignment_prior[negative_indices],
-                    #                            torch.tensor(0.),
-                    #                            atol=1e-4)):
-                    #     cluster_assignment_prior[negative_indices] = 0.
-                    cluster_assignment_prior[negative_indices] = 0.
-                    assert torch.all(cluster_assignment_prior >= 0.)
+                # Replace them with 0. Clamping in place avoids a boolean mask and the
+                # device-to-host sync of checking whether any entry is negative.
+                cluster_assignment_prior[:obs_idx + 1].clamp_(min=0.)
 
                 # Record latent prior.
-                assert_torch_no_nan_no_inf_is_real(cluster_assignment_prior)
-                cluster_assignment_priors[obs_idx, :len(cluster_assignment_prior)] = cluster_assignment_prior
+                if self.debug:
+                    assert_torch_no_nan_no_inf_is_real(cluster_assignment_prior)
+                cluster_assignment_priors[curr_row, :obs_idx + 1] = cluster_assignment_prior[:obs_idx + 1]
 
                 # Step 2(i): Initialize assignments at prior.
-                variational_params['assignments']['probs'][obs_idx, :] = cluster_assignment_prior.clone()
+                variational_params['assignments']['probs'][obs_idx, :obs_idx + 1] = cluster_assignment_prior[:obs_idx + 1]
 
                 # Step 2(ii): Create parameter for potential new cluster.
                 initialize_cluster_params_fn(torch_observation=torch_observation,
                                              obs_idx=obs_idx,
                                              variational_params=variational_params)
 
+                # The prior is fixed during coordinate ascent, so take its log once.
+                # Can get -inf here if probability of new cluster is 0.
+                log_cluster_assignment_prior = torch.log(cluster_assignment_prior[:obs_idx + 1])
+
                 # Step 3: Perform coordinate ascent on variational parameters.
-                approx_lower_bounds = []
-                for vi_idx in range(self.num_coord_ascent_steps_per_obs):
-                    # print(f'Obs Idx: {obs_idx}, VI idx: {vi_idx}')
-
-                    if self.numerically_optimize:
-                        raise NotImplementedError
-                    else:
-                        with torch.no_grad():
-                            # time_1 = time.time()
-
-                            optimize_cluster_assignments_fn(
-                                torch_observation=torch_observation,
-                                obs_idx=obs_idx,
-                                vi_idx=vi_idx,
-                                cluster_assignment_prior=cluster_assignment_prior,
-                                variational_params=variational_params,
-                                likelihood_params=self.gen_model_params['likelihood_params'])
-
-                            # time_2 = time.time()
-
-                            optimize_cluster_params_fn(
-                                torch_observation=torch_observation,
-                                obs_idx=obs_idx,
-                                vi_idx=vi_idx,
-                                variational_params=variational_params,
-                                likelihood_params=self.gen_model_params['likelihood_params'],
-                                cum_cluster_assignment_posteriors=cum_cluster_assignment_posteriors)
-
-                            # time_3 = time.time()
-                            # print(f'Time2 - Time1: {time_2 - time_1}')
-                            # print(f'Time3 - Time2: {time_3 - time_2}')
-
-                    # print(torch_observations[:obs_idx + 1])
-                    # print(variational_params['assignments']['probs'][obs_idx, :obs_idx+1])
-                    # print(variational_params['means']['means'][1, obs_idx, :obs_idx+1])
-
-                # Overwrite old variational parameters with curr variational parameters
-                for variable, variable_variational_params_dict in variational_params.items():
-                    if variable == 'assignments':
-                        continue
-                    for variational_param, variational_param_tensor in variable_variational_params_dict.items():
-                        variational_param_tensor[0] = variational_param_tensor[1]
-
-                cluster_assignment_posterior = variational_params['assignments']['probs'][obs_idx, :].clone()
+                # Every update is closed form, so no autograd graph is recorded.
+                with torch.no_grad():
+                    for vi_idx in range(self.num_coord_ascent_steps_per_obs):
+                        optimize_cluster_assignments_fn(
+                            torch_observation=torch_observation,
+                            obs_idx=obs_idx,
+                            vi_idx=vi_idx,
+                            log_cluster_assignment_prior=log_cluster_assignment_prior,
+                            variational_params=variational_params,
+                            likelihood_params=likelihood_params)
+
+                        optimize_cluster_params_fn(
+                            torch_observation=torch_observation,
+                            obs_idx=obs_idx,
+                            vi_idx=vi_idx,
+                            variational_params=variational_params,
+                            likelihood_params=likelihood_params,
+                            cum_cluster_assignment_posteriors=cum_cluster_assignment_posteriors)
+
+                # Overwrite old variational parameters with curr variational parameters.
+                # Only clusters up to the current observation can have changed.
+                for variational_param_tensor in rolling_variational_params:
+                    variational_param_tensor[0, :obs_idx + 1].copy_(variational_param_tensor[1, :obs_idx + 1])
+
+                cluster_assignment_posterior = variational_params['assignments']['probs'][obs_idx, :]
 
                 # Step 4: Update posterior over number of clusters.
                 # Use new approach with time complexity O(t).
-                cum_table_assignment_posterior = torch.cumsum(
-                    cluster_assignment_posterior[:obs_idx + 1],
-                    dim=0)
-                one_minus_cum_table_assignment_posterior = 1. - cum_table_assignment_posterior
-                prev_num_clusters_posterior = num_clusters_posteriors[obs_idx - 1, :obs_idx]
-                num_clusters_posteriors[obs_idx, :obs_idx] += torch.multiply(
-                    cum_table_assignment_posterior[:-1],
-                    prev_num_clusters_posterior)
-                num_clusters_posteriors[obs_idx, 1:obs_idx + 1] += torch.multiply(
-                    one_minus_cum_table_assignment_posterior[:-1],
-                    prev_num_clusters_posterior)
-
-                # time_4 = time.time()
-                # print(f'Time4 - Time3: {time_4 - time_3}')
+                update_num_clusters_posterior(
+                    prev_num_clusters_posterior=num_clusters_posteriors[prev_row, :obs_idx],
+                    cluster_assignment_posterior=cluster_assignment_posterior[:obs_idx + 1],
+                    num_clusters_posterior=num_clusters_posteriors[curr_row, :obs_idx + 1])
 
                 # Step 5: Update dynamics state using new cluster assignment posterior.
                 self.dynamics.update_state(
                     customer_assignment_probs=cluster_assignment_posterior,
-                    time=torch_observations_times[obs_idx])
-
-                # time_5 = time.time()
-                # print(f'Time5 - Time4: {time_5 - time_4}')
+                    time=observations_times[obs_idx])
 
-            cum_cluster_assignment_posteriors += cluster_assignment_posterior
+            # Entries past the current observation are zero, so only add the active slice.
+            cum_cluster_assignment_posteriors[:obs_idx + 1] += cluster_assignment_posterior[:obs_idx + 1]
             #
             # plt.close()
             # plt.scatter(1 + np.arange(obs_idx + 1),
@@ -402,28 +420,53 @@ class DynamicalCRP(BaseModel):
             # plt.close()
             # print()
 
+        # Without history, only the priors and number-of-clusters posterior
+        # after the last observation are returned.
+        if not self.record_history:
+            cluster_assignment_priors = cluster_assignment_priors[curr_row]
+            num_clusters_posteriors = num_clusters_posteriors[curr_row]
+
+        # Copy each result to the host exactly once; everything below works on NumPy.
+        # Fitting runs under no_grad, so nothing needs detaching.
+        cluster_assignment_priors = cluster_assignment_priors.cpu().numpy()
+        cluster_assignment_posteriors = variational_params['assignments']['probs'].cpu().numpy()
+        num_clusters_posteriors = num_clusters_posteriors.cpu().numpy()
+
         # Add 1 because of indexing starts at 0.
         # TODO: Is this really the right way to determine the number of inferred clusters?
-        num_inferred_clusters = 1 + torch.argmax(
-            num_clusters_posteriors, dim=1).numpy()[-1].item()
+        num_inferred_clusters = 1 + int(np.argmax(
+            num_clusters_posteriors[curr_row] if self.record_history else num_clusters_posteriors))
 
         variational_parameters = {}
         for variable, variable_variational_params_dict in variational_params.items():
             if variable == 'assignments':
                 continue
             for variational_param, variational_param_tensor in variable_variational_params_dict.items():
-                variational_parameters[variational_param] = variational_param_tensor[1].numpy()
+                variational_parameters[variational_param] = variational_param_tensor[1].float().cpu().numpy()
 
         self.fit_results = dict(
-            cluster_assignment_priors=cluster_assignment_priors.numpy(),
-            cluster_assignment_posteriors=variational_params['assignments']['probs'].detach().numpy(),
-            num_clusters_posteriors=num_clusters_posteriors.numpy(),
+            cluster_assignment_priors=cluster_assignment_priors,
+            cluster_assignment_posteriors=cluster_assignment_posteriors,
+            num_clusters_posteriors=num_clusters_posteriors,
             num_inferred_clusters=num_inferred_clusters,
             parameters=variational_parameters,
         )
 
         return self.fit_results
 
+    def iterate_dataloader_observations(self,
+                                        dataloader: torch.utils.data.DataLoader):
+        """
+        Yield observations one at a time from a (possibly batched) dataloader.
+
+        Each batch is moved to the device in a single transfer, so larger
+        dataloader batch sizes amortize loading and transfer overhead.
+        """
+        for batch_idx, batch in enumerate(dataloader):
+            if batch_idx % 100 == 0:
+                logger.debug(f"Batch Idx: {batch_idx}\tclasses: {batch['target'].tolist()}")
+            yield from batch['observations'].to(self.device)
+
     def centroids_after_last_obs(self) -> np.ndarray:
         """
         Returns array of shape (num features, feature dimension)
@@ -450,7 +493,8 @@ class DynamicalCRP(BaseModel):
             variational_params['means']['means'].data[:, obs_idx, :] = torch_observation
         else:
             raise ValueError
-        assert_torch_no_nan_no_inf_is_real(variational_params['means']['means'])
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(variational_params['means']['means'])
 
     def initialize_cluster_params_product_bernoullis(self,
                                                      torch_observation: np.ndarray,
@@ -471,8 +515,9 @@ class DynamicalCRP(BaseModel):
 
         else:
             raise ValueError
-        assert_torch_no_nan_no_inf_is_real(variational_params['beta']['arg1'])
-        assert_torch_no_nan_no_inf_is_real(variational_params['beta']['arg2'])
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(variational_params['beta']['arg1'])
+            assert_torch_no_nan_no_inf_is_real(variational_params['beta']['arg2'])
 
     def initialize_cluster_params_vonmises_fisher(self,
                                                   torch_observation: np.ndarray,
@@ -489,7 +534,8 @@ class DynamicalCRP(BaseModel):
         #     raise ValueError
         variational_params['means']['means'].data[:, obs_idx, :] = torch_observation
 
-        assert_torch_no_nan_no_inf_is_real(variational_params['means']['means'])
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(variational_params['means']['means'])
 
     @staticmethod
     def optimize_cluster_assignments_dirichlet_multinomial() -> None:
@@ -499,44 +545,28 @@ class DynamicalCRP(BaseModel):
                                                          torch_observation: torch.Tensor,
                                                          obs_idx: int,
                                                          vi_idx: int,
-                                                         cluster_assignment_prior: torch.Tensor,
+                                                         log_cluster_assignment_prior: torch.Tensor,
                                                          variational_params: Dict[str, dict],
                                                          likelihood_params: Dict[str, float],
                                                          ) -> None:
 
         obs_dim = torch_observation.shape[0]
-        sigma_obs_squared = self.likelihood_params['likelihood_cov_prefactor']
+        sigma_obs_squared = float(self.likelihood_params['likelihood_cov_prefactor'])
 
         # Term 1: log q(c_n = l | o_{<n})
-        # Can get -inf here if probability of new cluster is 0.
-        term_one = torch.log(cluster_assignment_prior[:obs_idx + 1])
-
-        # Term 2: -o_n^T o_n / 2 sigma_obs^T
-        term_two = -0.5 * torch.inner(
-            torch_observation, torch_observation) / sigma_obs_squared
-        assert_torch_no_nan_no_inf_is_real(term_two)
-
-        # Term 3: mu_{nk}^T o_n / sigma_obs^2
-        term_three = torch.einsum(
-            'kd,d->k',
-            variational_params['means']['means'][1, :obs_idx + 1, :],
-            torch_observation) / sigma_obs_squared
-        assert_torch_no_nan_no_inf_is_real(term_three)
-
-        # Term 4:
-        term_four = - 0.5 * torch.add(
-            torch.sum(variational_params['means']['diag_covs'][1, :obs_idx + 1, :],
-                      dim=1),  # Trace of diagonal covariance. Shape: (max number current clusters,)
-            torch.einsum('ki,ki->k',
-                         variational_params['means']['means'][1, :obs_idx + 1, :],
-                         variational_params['means']['means'][1, :obs_idx + 1, :]),  # Tr[\mu_n \mu_n^T]
-        ) / sigma_obs_squared
-        assert_torch_no_nan_no_inf_is_real(term_four)
-
-        # Term 4: -D * log(2 pi sigma_obs_squared) / 2
-        term_five = -obs_dim * np.log(2 * np.pi * sigma_obs_squared) / 2.
-
-        term_to_softmax = term_one + term_two + term_three + term_four + term_five
+        term_one = log_cluster_assignment_prior
+
+        # Term 2: E_{q(phi_{nk})}[log N(o_n; phi_{nk}, sigma_obs^2 I)]
+        # Shape: (max number current clusters,)
+        term_two = expected_log_isotropic_gaussian_likelihood(
+            observation=torch_observation,
+            means=variational_params['means']['means'][1, :obs_idx + 1, :].float(),
+            precisions=variational_params['means']['precisions'][1, :obs_idx + 1, :],
+            sigma_obs_squared=sigma_obs_squared)
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(term_two)
+
+        term_to_softmax = term_one + term_two
 
         # For the new cluster, the likelihood is N(0, likelihood cov + cluster mean prior cov)
         # Consequently, we need to overwrite the last index with the correct value.
@@ -544,19 +574,18 @@ class DynamicalCRP(BaseModel):
             new_cluster_var = sigma_obs_squared + self.component_prior_params['centroids_prior_cov_prefactor']
             replacement_term_one = term_one[obs_idx]
             # Since mean mu_{nk} = 0, term two is 0 and we can skip.
-            replacement_term_three = -0.5 * torch.square(torch.linalg.norm(torch_observation)) / \
+            replacement_term_three = -0.5 * torch.inner(torch_observation, torch_observation) / \
                                      new_cluster_var
             replacement_term_four = -obs_dim * np.log(2 * np.pi * new_cluster_var) / 2.
             term_to_softmax[obs_idx] = replacement_term_one + replacement_term_three + replacement_term_four
 
-        cluster_assignment_posterior = torch.nn.functional.softmax(
+        cluster_assignment_posterior = torch.softmax(
             term_to_softmax,  # shape: (max num clusters, )
-            dim=0)
+            dim=-1)
 
-        # check that Bernoulli probs are all valid
-        assert_torch_no_nan_no_inf_is_real(cluster_assignment_posterior)
-        assert torch.all(0. <= cluster_assignment_posterior)
-        assert torch.all(cluster_assignment_posterior <= 1.)
+        # Check that probabilities are all valid.
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(cluster_assignment_posterior)
 
         variational_params['assignments']['probs'][obs_idx, :obs_idx + 1] = cluster_assignment_posterior
 
@@ -566,13 +595,12 @@ class DynamicalCRP(BaseModel):
                                                         torch_observation: torch.Tensor,
                                                         obs_idx: int,
                                                         vi_idx: int,
-                                                        cluster_assignment_prior: torch.Tensor,
+                                                        log_cluster_assignment_prior: torch.Tensor,
                                                         variational_params: Dict[str, dict],
                                                         likelihood_params: Dict[str, float]):
 
         # Term 1: log q(c_n = l | o_{<n})
-        # Warning: can get -inf here if probability of new cluster is 0
-        term_one = torch.log(cluster_assignment_prior[:obs_idx + 1])
+        term_one = log_cluster_assignment_prior
 
         # Shape: (curr max num clusters i.e. obs idx, obs dim)
         arg1_plus_arg2 = torch.add(
@@ -600,7 +628,8 @@ class DynamicalCRP(BaseModel):
 
         # Shape: (curr max num clusters i.e. obs idx ,)
         term_two = term_two_part_one + term_two_part_two
-        assert_torch_no_nan_no_inf_is_real(term_two)
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(term_two)
 
         term_to_softmax = term_one + term_two
 
@@ -610,14 +639,13 @@ class DynamicalCRP(BaseModel):
             # TODO: Implement this
             raise NotImplementedError
 
-        cluster_assignment_posterior_params = torch.nn.functional.softmax(
+        cluster_assignment_posterior_params = torch.softmax(
             term_to_softmax,  # shape: (max num clusters, )
-            dim=0)
+            dim=-1)
 
-        # check that Bernoulli probs are all valid
-        assert_torch_no_nan_no_inf_is_real(cluster_assignment_posterior_params)
-        assert torch.all(0. <= cluster_assignment_posterior_params)
-        assert torch.all(cluster_assignment_posterior_params <= 1.)
+        # Check that probabilities are all valid.
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(cluster_assignment_posterior_params)
 
         # Shape: (curr max num clusters i.e. obs idx)
         variational_params['assignments']['probs'][obs_idx, :obs_idx + 1] = cluster_assignment_posterior_params
@@ -626,30 +654,31 @@ class DynamicalCRP(BaseModel):
                                                      torch_observation: torch.Tensor,
                                                      obs_idx: int,
                                                      vi_idx: int,
-                                                     cluster_assignment_prior: torch.Tensor,
+                                                     log_cluster_assignment_prior: torch.Tensor,
                                                      variational_params: Dict[str, dict],
                                                      likelihood_params: Dict[str, float],
                                                      ) -> None:
 
         # Term 1: log q(c_n = l | o_{<n})
         # Shape: (max num clusters, )
-        # Warning: can get -inf here if probability of new cluster is 0
-        term_one = torch.log(cluster_assignment_prior[:obs_idx + 1])
+        term_one = log_cluster_assignment_prior
 
+        # E[phi_{nk}] = A_d(kappa_{nk}) mu_{nk}
+        # Shape: (max num clusters, )
+        mean_resultant_lengths = self.compute_vonmisesfisher_mean_resultant_length(
+            dim=torch_observation.shape[0],
+            kappas=variational_params['means']['concentrations'][1, :obs_idx + 1, 0].float().cpu().numpy())
         # Shape: (max num clusters, obs dim)
-        # TODO: Refactor to not use TensorFlow
-        tf_means = tfd.VonMisesFisher(
-            mean_direction=variational_params['means']['means'][1, :obs_idx + 1, :].numpy(),
-            concentration=variational_params['means']['concentrations'][1, :obs_idx + 1, 0].numpy()).mean()
-        torch_means = torch.from_numpy(tf_means.numpy())
+        torch_means = torch.from_numpy(mean_resultant_lengths).to(torch_observation)[:, None] \
+                      * variational_params['means']['means'][1, :obs_idx + 1, :]
 
         # Term 2: E[phi_{nk}]^T o_n / sigma_obs^2 = kappa * E[phi_{nk}]^T o_n
         # Shape: (max num clusters, )
-        term_two = likelihood_params['likelihood_kappa'] * torch.einsum(
-            'kd,d->k',
+        term_two = likelihood_params['likelihood_kappa'] * torch.mv(
             torch_means,
             torch_observation)
-        assert_torch_no_nan_no_inf_is_real(term_two)
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(term_two)
 
         term_to_softmax = term_one + term_two
 
@@ -661,14 +690,13 @@ class DynamicalCRP(BaseModel):
             # observation with a flat prior on the direction doesn't depend on the observation.
             term_to_softmax[obs_idx] = term_one[obs_idx] + self.log_likelihood_new_cluster
 
-        cluster_assignment_posterior_params = torch.nn.functional.softmax(
+        cluster_assignment_posterior_params = torch.softmax(
             term_to_softmax,  # shape: (curr max num clusters i.e. obs idx, )
-            dim=0)
+            dim=-1)
 
         # Check that probabilities are all valid.
-        assert_torch_no_nan_no_inf_is_real(cluster_assignment_posterior_params)
-        assert torch.all(0. <= cluster_assignment_posterior_params)
-        assert torch.all(cluster_assignment_posterior_params <= 1.)
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(cluster_assignment_posterior_params)
 
         variational_params['assignments']['probs'][obs_idx, :obs_idx + 1] = cluster_assignment_posterior_params
 
@@ -689,7 +717,7 @@ class DynamicalCRP(BaseModel):
         #                               b=torch_observation)
         #
         #     log_x_times_beta_terms = torch.add(log_beta_terms, torch.log(torch_observation))
-        #     log_x_times_beta_terms[torch.isnan(log_x_times_beta_terms)] = 0.
+        #     log_x_times_beta_terms = torch.nan_to_num(log_x_times_beta_terms, nan=0.)
         #     log_denominator = torch.sum(log_x_times_beta_terms, dim=1)
         #
         #     assert_torch_no_nan_no_inf_is_real(log_denominator)
@@ -716,31 +744,26 @@ class DynamicalCRP(BaseModel):
             # Recall, we only update the previous clusters' parameters.
             max_cluster_idx_to_update = obs_idx
 
-        new_arg_1 = torch.add(
-            variational_params['beta']['arg1'][0, :max_cluster_idx_to_update, :],  # previous parameter values
-            torch.einsum(
-                'c,o->co',
-                variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update],
-                # Shape: (curr max num clusters ,)
-                torch_observation,  # Shape: (obs dim,)
-            )
-        )
-        assert_torch_no_nan_no_inf_is_real(new_arg_1)
-
-        new_arg_2 = torch.add(
-            variational_params['beta']['arg2'][0, :max_cluster_idx_to_update, :],  # previous parameter values
-            torch.einsum(
-                'c,o->co',
-                variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update],
-                # Shape: (curr max num clusters,)
-                1. - torch_observation,  # Shape: (obs dim,)
-            ))
-        assert_torch_no_nan_no_inf_is_real(new_arg_2)
+        # Shape: (curr max num clusters, obs dim)
+        prev_arg_1 = variational_params['beta']['arg1'][0, :max_cluster_idx_to_update, :]
+        prev_arg_2 = variational_params['beta']['arg2'][0, :max_cluster_idx_to_update, :]
+
+        # Shape: (curr max num clusters,)
+        probs = variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update]
+
+        # addr adds the outer product q(c_n = k) o^T to the previous values in one kernel.
+        new_arg_1 = torch.addr(prev_arg_1, probs, torch_observation)
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(new_arg_1)
+
+        new_arg_2 = torch.addr(prev_arg_2, probs, 1. - torch_observation)
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(new_arg_2)
 
         if not self.robbins_monro_cavi_updates:
             # Don't reduce effective step size.
-            variational_params['beta']['arg1'][1, :obs_idx + 1, :] = new_arg_1
-            variational_params['beta']['arg2'][1, :obs_idx + 1, :] = new_arg_2
+            variational_params['beta']['arg1'][1, :max_cluster_idx_to_update, :] = new_arg_1
+            variational_params['beta']['arg2'][1, :max_cluster_idx_to_update, :] = new_arg_2
         else:
             # Take linear combination: step size * new + (1-step size) * old
             step_size_per_cluster = self.compute_step_size(
@@ -757,7 +780,7 @@ class DynamicalCRP(BaseModel):
                 ),
                 torch.multiply(
                     1. - step_size_per_cluster[:, np.newaxis],  # Shape (max clusters to update, 1)
-                    variational_params['beta']['arg1'][0, :max_cluster_idx_to_update, :],
+                    prev_arg_1,
                 )
             )
 
@@ -768,7 +791,7 @@ class DynamicalCRP(BaseModel):
                 ),
                 torch.multiply(
                     1. - step_size_per_cluster[:, np.newaxis],  # Shape (max clusters to update, 1)
-                    variational_params['beta']['arg2'][0, :max_cluster_idx_to_update, :],
+                    prev_arg_2,
                 )
             )
 
@@ -791,37 +814,26 @@ class DynamicalCRP(BaseModel):
             # Recall, we only update the previous clusters' parameters.
             max_cluster_idx_to_update = obs_idx
 
-        sigma_obs_squared = likelihood_params['likelihood_cov_prefactor']
+        sigma_obs_squared = float(likelihood_params['likelihood_cov_prefactor'])
         assert sigma_obs_squared > 0.
 
-        prev_means_means = variational_params['means']['means'][0, :max_cluster_idx_to_update, :].clone()
+        prev_means_means = variational_params['means']['means'][0, :max_cluster_idx_to_update, :].float()
 
-        # time_2_1 = time.time()
-        prev_means_diag_precisions = 1. / variational_params['means']['diag_covs'][0, :max_cluster_idx_to_update, :]
-        # time_2_2 = time.time()
-        # print(f'Time2.2 - Time2.1: {time_2_2 - time_2_1}')
+        prev_means_precisions = variational_params['means']['precisions'][0, :max_cluster_idx_to_update, :]
 
-        obs_dim = torch_observation.shape[0]
-        curr_max_num_clusters = prev_means_means.shape[0]
-
-        # Step 1: Compute updated covariances
-        # Take I_{D \times D} and repeat to add a batch dimension
-        # Shape (max clusters to update, obs_dim,)
-        repeated_diag_eyes = torch.ones(size=(1, obs_dim)).repeat(
-            curr_max_num_clusters, 1)
-        weighted_diag_eyes = torch.multiply(
-            variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update, np.newaxis],
-            repeated_diag_eyes,
-        ) / sigma_obs_squared
-        new_mean_diag_precisions = torch.add(prev_means_diag_precisions, weighted_diag_eyes)
-        new_means_diag_covs = 1. / new_mean_diag_precisions
-
-        # time_2_3 = time.time()
-        # print(f'Time2.3 - Time2.2: {time_2_3 - time_2_2}')
+        # Step 1: Compute updated precisions and means in one fused call.
+        # The precision update adds w_k I_{D \times D} with w_k = q(c_n = k) / sigma_obs^2.
+        # Shapes (max clusters to update, obs_dim,) and (max clusters to update, 1)
+        new_means_means, new_means_precisions = update_isotropic_gaussian_posterior(
+            prev_means=prev_means_means,
+            prev_precisions=prev_means_precisions,
+            probs=variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update],
+            observation=torch_observation,
+            sigma_obs_squared=sigma_obs_squared)
 
         if not self.robbins_monro_cavi_updates:
             # Don't reduce effective step size.
-            variational_params['means']['diag_covs'][1, :max_cluster_idx_to_update, :] = new_means_diag_covs
+            variational_params['means']['precisions'][1, :max_cluster_idx_to_update, :] = new_means_precisions
         else:
             step_size_per_cluster = self.compute_step_size(
                 variational_params=variational_params,
@@ -830,56 +842,29 @@ class DynamicalCRP(BaseModel):
                 cum_cluster_assignment_posteriors=cum_cluster_assignment_posteriors,
             )
 
-            # Shape: (curr max num clusters, obs dim)
-            # Take linear combination: step size * new + (1-step size) * old
-            scaled_new_means_diag_covs = torch.add(
+            # Shape: (curr max num clusters, 1)
+            # Take linear combination of covariances: step size * new + (1-step size) * old
+            scaled_new_means_covs = torch.add(
                 torch.multiply(
                     step_size_per_cluster[:, np.newaxis],  # Shape (curr max num clusters - 1, 1)
-                    new_means_diag_covs,  # Shape (curr max num clusters - 1, obs dim)
+                    torch.reciprocal(new_means_precisions),  # Shape (curr max num clusters - 1, 1)
                 ),
                 torch.multiply(
                     1. - step_size_per_cluster[:, np.newaxis],  # Shape (curr max num clusters, 1)
-                    variational_params['means']['diag_covs'][0, :max_cluster_idx_to_update, :],
+                    torch.reciprocal(prev_means_precisions),
                 )
             )
-            # Shape: (curr max num obs - 1, obs dim)
-            variational_params['means']['diag_covs'][1, :max_cluster_idx_to_update, :] = scaled_new_means_diag_covs
-
-        # Slowest piece
-        # time_2_3_1 = time.time()
-        # print(f'Time2.3.1 - Time2.3: {time_2_3_1 - time_2_3}')
-
-        assert_torch_no_nan_no_inf_is_real(
-            variational_params['means']['diag_covs'][1, :max_cluster_idx_to_update, :])
-
-        # time_2_4 = time.time()
-        # print(f'Time2.4 - Time2.3: {time_2_4 - time_2_3}')
-
-        # Step 2: Use updated covariances to compute updated means
-        # Sigma_{n-1,l}^{-1} \mu_{n-1, l}
-        term_one = torch.einsum(
-            'ai,ai->ai',
-            prev_means_diag_precisions,
-            prev_means_means)
-
-        # Need to add 1 when repeating because obs_idx starts at 0.
-        term_two = torch.einsum(
-            'k, kd->kd',
-            variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update],
-            # Shape: (max clusters to update, )
-            torch_observation.reshape(1, obs_dim).repeat(max_cluster_idx_to_update, 1),
-            # Shape: (max clusters to update, obs dim)
-        ) / sigma_obs_squared
+            # Shape: (curr max num obs - 1, 1)
+            variational_params['means']['precisions'][1, :max_cluster_idx_to_update, :] = torch.reciprocal(
+                scaled_new_means_covs)
 
-        new_means_means = torch.einsum(
-            'bi, bi->bi',  # Technically, should be matrix multiplication, but we have diagonal matrix
-            new_means_diag_covs,  # shape: (curr max num clusters -1, obs dim,)
-            torch.add(term_one, term_two),  # shape: (curr max num clusters -1, obs dim)
-        )
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(
+                variational_params['means']['precisions'][1, :max_cluster_idx_to_update, :])
 
-        # time_2_5 = time.time()
-        # print(f'Time2.5 - Time2.4: {time_2_5 - time_2_4}')
-        assert_torch_no_nan_no_inf_is_real(new_means_means)
+        # Step 2: Update means using the updated precisions.
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(new_means_means)
 
         if not self.robbins_monro_cavi_updates:
             # Don't reduce effective step size.
@@ -894,7 +879,7 @@ class DynamicalCRP(BaseModel):
                 ),
                 torch.multiply(
                     1. - step_size_per_cluster[:, np.newaxis],  # Shape (max clusters to update, 1)
-                    variational_params['means']['means'][0, :max_cluster_idx_to_update, :],
+                    prev_means_means,
                 )
             )
             # Shape: (max clusters to update, obs dim)
@@ -915,23 +900,21 @@ class DynamicalCRP(BaseModel):
             # Recall, we only update the previous clusters' parameters.
             max_cluster_idx_to_update = obs_idx
 
-        rhs = torch.add(
-            torch.multiply(variational_params['means']['concentrations'][0, :max_cluster_idx_to_update, :],
-                           # (curr max num clusters - 1, 1)
-                           variational_params['means']['means'][0, :max_cluster_idx_to_update, :],
-                           # (curr max num clusters - 1, obs dim)
-                           ),  # Shape: (curr max num clusters , obs dim)
-            likelihood_params['likelihood_kappa'] * torch.multiply(
-                variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update, None],
-                # Shape (curr max num clusters - 1, 1)
-                torch_observation[None, :],  # Shape: (1, obs dim,)
-            ),  # Shape: (curr max num clusters, obs dim)
-        )  # Shape: (curr max num clusters, obs dim)
-
-        magnitudes = torch.norm(rhs, dim=1, keepdim=True)  # Shape: (curr max num clusters, 1)
-        assert_torch_no_nan_no_inf_is_real(magnitudes)
-        directions = rhs / magnitudes  # Shape: (max num clusters, obs dim)
-        assert_torch_no_nan_no_inf_is_real(directions)
+        # Shape: (curr max num clusters, obs dim)
+        prev_means_means = variational_params['means']['means'][0, :max_cluster_idx_to_update, :].float()
+        # Shape: (curr max num clusters, 1)
+        prev_means_concentrations = variational_params['means']['concentrations'][0, :max_cluster_idx_to_update, :]
+
+        # Shapes: (curr max num clusters, obs dim) and (curr max num clusters, 1)
+        directions, magnitudes = update_vonmisesfisher_posterior(
+            prev_means=prev_means_means,
+            prev_concentrations=prev_means_concentrations,
+            probs=variational_params['assignments']['probs'][obs_idx, :max_cluster_idx_to_update],
+            observation=torch_observation,
+            likelihood_kappa=float(likelihood_params['likelihood_kappa']))
+        if self.debug:
+            assert_torch_no_nan_no_inf_is_real(magnitudes)
+            assert_torch_no_nan_no_inf_is_real(directions)
 
         # print(f'Obs Idx: {obs_idx}\tVI Idx{vi_idx}\tDirections:\n{directions.numpy()}')
 
@@ -954,7 +937,7 @@ class DynamicalCRP(BaseModel):
                 ),
                 torch.multiply(
                     1. - step_size_per_cluster[:, np.newaxis],  # Shape (max clusters to update, 1)
-                    variational_params['means']['means'][0, :max_cluster_idx_to_update, :],
+                    prev_means_means,
                 )
             )
 
@@ -965,7 +948,7 @@ class DynamicalCRP(BaseModel):
                 ),
                 torch.multiply(
                     1. - step_size_per_cluster[:, np.newaxis],  # Shape (max clusters to update, 1)
-                    variational_params['means']['concentrations'][0, :max_cluster_idx_to_update, :],
+                    prev_means_concentrations,
                 )
             )
 
@@ -987,8 +970,9 @@ class DynamicalCRP(BaseModel):
             denominator)
 
         # If the cumulative probability mass is 0, the previous few lines
-        # will divide 0/0 and result in NaN. Consequently, we mask those values.
-        step_size_per_cluster[torch.isnan(step_size_per_cluster)] = 0.
+        # will divide 0/0 and result in NaN. Consequently, we zero those values.
+        # The denominator is at least the numerator, so no infs can arise.
+        step_size_per_cluster = torch.nan_to_num(step_size_per_cluster, nan=0.)
 
         return step_size_per_cluster
 
@@ -1010,6 +994,19 @@ class DynamicalCRP(BaseModel):
     #             assert torch.all(cluster_assignment_prior >= 0.)
 
     @staticmethod
+    def compute_vonmisesfisher_mean_resultant_length(dim: int,
+                                                     kappas: np.ndarray) -> np.ndarray:
+        """
+        A_d(kappa) = I_{d/2}(kappa) / I_{d/2-1}(kappa), using exponentially scaled
+        Bessel functions to avoid overflow for large kappa.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_resultant_lengths = scipy.special.ive(dim / 2., kappas) \
+                                     / scipy.special.ive(dim / 2. - 1., kappas)
+        return np.where(kappas > 0., mean_resultant_lengths, 0.)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
     def compute_vonmisesfisher_normalization(dim: int,
                                              kappa: float):
         if kappa > 0.:
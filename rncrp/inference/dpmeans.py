@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 from scipy.spatial.distance import cdist
 from sklearn.metrics.pairwise import euclidean_distances
@@ -6,6 +7,9 @@ from typing import Dict
 from rncrp.inference.base import BaseModel
 
 
+logger = logging.getLogger(__name__)
+
+
 class DPMeans(BaseModel):
 
     def __init__(self,
@@ -60,12 +64,12 @@ class DPMeans(BaseModel):
         # num_centers = centers_init.shape[0]
         # centers[:num_centers, :] = centers_init
 
-        cluster_assignments = np.full(num_obs, fill_value=-1, dtype=np.int)
+        cluster_assignments = np.full(num_obs, fill_value=-1, dtype=int)
 
         iter_idx = 0
         for iter_idx in range(self.max_iter):
 
-            print(f'Num centers: {num_centers}')
+            logger.debug(f'Num centers: {num_centers}')
 
             datum_reassigned = False
 
@@ -108,7 +112,7 @@ class DPMeans(BaseModel):
             # Update centers based on assigned data.
             centers_to_keep = np.full(centers.shape[0],
                                       fill_value=False,
-                                      dtype=np.bool)
+                                      dtype=bool)
             for center_idx in range(num_centers):
 
                 # Get indices of all observations assigned to that cluster.
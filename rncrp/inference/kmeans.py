@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 from scipy.spatial.distance import cdist
 from sklearn.preprocessing import OneHotEncoder
@@ -6,6 +7,9 @@ from typing import Dict
 from rncrp.inference.base import BaseModel
 
 
+logger = logging.getLogger(__name__)
+
+
 class KMeans(BaseModel):
     """
     KMeans. Wrapper around scikit-learn's implementation.
@@ -63,7 +67,7 @@ class KMeans(BaseModel):
             )
             centers = observations[center_indices, :]
 
-        cluster_assignments_posteriors = np.full(num_obs, fill_value=-1, dtype=np.int)
+        cluster_assignments_posteriors = np.full(num_obs, fill_value=-1, dtype=int)
 
         for iter_idx in range(self.max_iter):
 
@@ -108,7 +112,7 @@ class KMeans(BaseModel):
                 # Recompute centroid from assigned observations.
                 centers[center_idx, :] = np.mean(points_in_assigned_cluster, axis=0)
 
-        print(f'Converged in {self.n_iters_till_convergence} iterations.')
+        logger.info(f'Converged in {self.n_iters_till_convergence} iterations.')
 
         cluster_assignment_posteriors_one_hot = OneHotEncoder(sparse=False).fit_transform(
             cluster_assignments_posteriors.reshape(-1, 1))
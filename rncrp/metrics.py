@@ -3,7 +3,6 @@ import sklearn.metrics
 from sklearn.metrics import adjusted_rand_score, rand_score, adjusted_mutual_info_score, \
     normalized_mutual_info_score, f1_score
 import sklearn.metrics.cluster
-from sklearn.metrics.pairwise import euclidean_distances
 from typing import Dict, Tuple
 
 
@@ -86,15 +85,17 @@ def compute_sum_of_squared_distances_to_nearest_center(X: np.ndarray,
         centroids: (num centroids, obs dim)
     """
 
-    # Shape: (num centroids, num data)
-    squared_distances_to_centers = euclidean_distances(
-        X=centroids,
-        Y=X,
-        squared=True)
+    # The nearest center minimizes ||c||^2 - 2 x^T c; ||x||^2 is constant per datum.
+    # Shape: (num data, num centroids)
+    partial_squared_distances_to_centers = np.sum(np.square(centroids), axis=1) \
+                                           - 2. * X @ centroids.T
     # Shape: (num data,)
-    squared_distances_to_nearest_center = np.min(
-        squared_distances_to_centers,
-        axis=0)
+    nearest_center_idx = np.argmin(partial_squared_distances_to_centers, axis=1)
+    # Compute exact squared distances to the nearest centers only, avoiding the
+    # cancellation error of the expanded form.
+    squared_distances_to_nearest_center = np.sum(
+        np.square(X - centroids[nearest_center_idx]),
+        axis=1)
     sum_of_squared_distances_to_nearest_center = np.sum(squared_distances_to_nearest_center)
 
     return sum_of_squared_distances_to_nearest_center